@@ -0,0 +1,147 @@
+"""Замер CPU на один голосовой поток для разных режимов воспроизведения.
+
+Источники открываются так же, как в MusicPlayer, но по локальным файлам,
+а кадры вычитываются с максимальной скоростью без отправки в сеть.
+Для PCM-режимов учитывается и кодирование в Opus, которое в войсе
+делает discord.py.
+
+    python bench_audio.py track1.webm track2.opus --streams 4 --seconds 60
+
+С --stage-only FFmpeg не запускается: сравнивается только скорость
+обработки кадров (кадров/с) PCMVolumeTransformer и DSP-стадии.
+
+    python bench_audio.py --stage-only --seconds 600
+"""
+import argparse
+import os
+import resource
+import time
+
+import discord
+
+from fixed import FFMPEG_EXECUTABLE, DSPAudioSource, np
+
+FRAMES_PER_SECOND = 50  # кадр Discord — 20 мс
+
+
+def _cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def open_passthrough(path: str) -> discord.AudioSource:
+    return discord.FFmpegOpusAudio(path, executable=FFMPEG_EXECUTABLE, codec="opus", options="-vn")
+
+
+def open_pcm_volume(path: str) -> discord.AudioSource:
+    pcm = discord.FFmpegPCMAudio(path, executable=FFMPEG_EXECUTABLE, options="-vn")
+    return discord.PCMVolumeTransformer(pcm, volume=0.8)
+
+
+def open_pcm_dsp(path: str) -> discord.AudioSource:
+    pcm = discord.FFmpegPCMAudio(path, executable=FFMPEG_EXECUTABLE, options="-vn")
+    return DSPAudioSource(pcm, volume=0.8, normalize=True)
+
+
+MODES = {
+    "opus-passthrough": open_passthrough,
+    "pcm-volume": open_pcm_volume,
+    "pcm-dsp": open_pcm_dsp,
+}
+
+
+class _MemorySource(discord.AudioSource):
+    """Один и тот же кадр шума заданное число раз"""
+    
+    def __init__(self, frames: int):
+        self._frame = os.urandom(discord.opus.Encoder.FRAME_SIZE)
+        self._left = frames
+    
+    def read(self) -> bytes:
+        if self._left <= 0:
+            return b""
+        self._left -= 1
+        return self._frame
+
+
+def run_stage_only(seconds: float):
+    frames = int(seconds * FRAMES_PER_SECOND)
+    stages = {
+        "PCMVolumeTransformer": lambda: discord.PCMVolumeTransformer(_MemorySource(frames), volume=0.8),
+        "DSPAudioSource": lambda: DSPAudioSource(_MemorySource(frames), volume=0.8),
+        "DSPAudioSource+norm": lambda: DSPAudioSource(_MemorySource(frames), volume=0.8, normalize=True),
+    }
+    for name, factory in stages.items():
+        stage = factory()
+        start = time.perf_counter()
+        count = 0
+        while stage.read():
+            count += 1
+        elapsed = time.perf_counter() - start
+        print(f"{name:<22} кадров={count:<7} {count / elapsed:,.0f} кадров/с")
+
+
+def run_mode(opener, paths, streams: int, seconds: float) -> dict:
+    frames_wanted = int(seconds * FRAMES_PER_SECOND)
+    sources = [opener(paths[i % len(paths)]) for i in range(streams)]
+    encoder = discord.opus.Encoder()
+    
+    cpu_start = _cpu_seconds()
+    wall_start = time.perf_counter()
+    frames = 0
+    try:
+        for _ in range(frames_wanted):
+            alive = 0
+            for source in sources:
+                data = source.read()
+                if not data:
+                    continue
+                if not source.is_opus():
+                    encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+                frames += 1
+                alive += 1
+            if not alive:
+                break
+    finally:
+        for source in sources:
+            source.cleanup()
+    
+    wall = time.perf_counter() - wall_start
+    cpu = _cpu_seconds() - cpu_start
+    audio_seconds = frames / FRAMES_PER_SECOND
+    return {
+        "frames": frames,
+        "wall": wall,
+        "cpu": cpu,
+        # доля одного ядра, которую съедает один поток в реальном времени
+        "cpu_per_stream": cpu / audio_seconds if audio_seconds else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="локальные аудиофайлы (лучше Opus/WebM)")
+    parser.add_argument("--streams", type=int, default=4, help="одновременных потоков")
+    parser.add_argument("--seconds", type=float, default=60, help="секунд аудио на поток")
+    parser.add_argument("--mode", choices=sorted(MODES), action="append", help="режим (по умолчанию все)")
+    parser.add_argument("--stage-only", action="store_true", help="только скорость обработки кадров, без FFmpeg")
+    args = parser.parse_args()
+    
+    if args.stage_only:
+        run_stage_only(args.seconds)
+        return
+    if not args.files:
+        parser.error("укажите хотя бы один аудиофайл")
+    
+    modes = args.mode or [m for m in MODES if m != "pcm-dsp" or np is not None]
+    for name in modes:
+        result = run_mode(MODES[name], args.files, args.streams, args.seconds)
+        print(
+            f"{name:<18} потоков={args.streams:<3} кадров={result['frames']:<7} "
+            f"CPU={result['cpu']:.2f}с  CPU/поток={result['cpu_per_stream'] * 100:.2f}% ядра"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Память и скорость счётчика спама на большом числе авторов.
+
+Сравнивается SpamTracker (кольцевые буферы в массивах) и прежняя схема:
+словарь со списком отметок времени на каждого автора. Каждый автор пишет
+по несколько сообщений, затем измеряется прирост кучи (tracemalloc)
+и время одного учёта сообщения.
+
+    python bench_spam.py --authors 1000000 --messages 3
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+
+from fixed import SPAM_THRESHOLD, SPAM_TIME_WINDOW, SpamTracker
+
+
+class DictOfLists:
+    """Прежняя схема из on_message: список отметок на каждого автора"""
+    
+    def __init__(self, threshold: int, window: float):
+        self.threshold = threshold
+        self.window = window
+        self.history = {}
+    
+    def __len__(self) -> int:
+        return len(self.history)
+    
+    def hit(self, guild_id: int, user_id: int, now: float) -> bool:
+        key = (guild_id, user_id)
+        history = [t for t in self.history.get(key, []) if now - t < self.window]
+        history.append(now)
+        self.history[key] = history
+        return len(history) >= self.threshold
+
+
+def _authors(count: int, guilds: int):
+    rng = random.Random(1)
+    base = 10 ** 17
+    return [(base + rng.randrange(guilds), base + rng.randrange(10 ** 17)) for _ in range(count)]
+
+
+def measure(factory, authors, messages: int) -> dict:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracker = factory(SPAM_THRESHOLD, SPAM_TIME_WINDOW)
+    
+    now = time.time()
+    started = time.perf_counter()
+    for i in range(messages):
+        for guild_id, user_id in authors:
+            tracker.hit(guild_id, user_id, now + i * 0.01)
+    elapsed = time.perf_counter() - started
+    
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "tracker": tracker,
+        "bytes": current - before,
+        "peak": peak - before,
+        "hit_ns": elapsed / (messages * len(authors)) * 1e9,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--authors", type=int, default=1_000_000, help="различных (сервер, пользователь)")
+    parser.add_argument("--guilds", type=int, default=5000, help="число серверов")
+    parser.add_argument("--messages", type=int, default=3, help="сообщений на автора")
+    args = parser.parse_args()
+    
+    authors = _authors(args.authors, args.guilds)
+    for name, factory in (("ring-buffer", SpamTracker), ("dict-of-lists", DictOfLists)):
+        result = measure(factory, authors, args.messages)
+        print(
+            f"{name:<14} авторов={len(result['tracker']):<8} куча={result['bytes'] / 1024 ** 2:.1f} МБ "
+            f"({result['bytes'] / args.authors:.0f} Б/автор, пик {result['peak'] / 1024 ** 2:.1f} МБ) "
+            f"учёт={result['hit_ns']:.0f} нс"
+        )
+        tracker = result.pop("tracker")
+        if isinstance(tracker, SpamTracker):
+            started = time.perf_counter()
+            evicted = asyncio.run(tracker.evict_idle(time.time() + SPAM_TIME_WINDOW * 10))
+            print(f"{'':<14} фоновая очистка: {evicted} слотов за {time.perf_counter() - started:.2f} с")
+        del tracker
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Запуск бота кластером: несколько процессов, у каждого свой диапазон шардов.
+
+Каждый процесс получает SHARD_COUNT (всего шардов), CLUSTER_SHARD_IDS
+(свои шарды через запятую) и CLUSTER_ID. Настройки серверов процессы
+делят через общее хранилище (STATE_BACKEND / STATE_DB_PATH в fixed.py).
+
+    DISCORD_TOKEN=... python cluster.py --clusters 4
+
+Без --shards число шардов берётся из рекомендации Discord (/gateway/bot).
+Упавший процесс перезапускается с нарастающей паузой.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+RESTART_BACKOFF_MAX = 60
+# процесс, проработавший столько, считается здоровым — пауза сбрасывается
+HEALTHY_UPTIME = 5 * 60
+
+
+def recommended_shards(token: str) -> int:
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (cluster.py, 1.0)"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return int(json.load(response)["shards"])
+
+
+def split_shards(shard_count: int, clusters: int) -> list:
+    """Непрерывные диапазоны шардов почти равного размера"""
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for i in range(clusters):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class Cluster:
+    """Один процесс бота и его политика перезапуска"""
+    
+    def __init__(self, cluster_id: int, shard_ids: list, shard_count: int, script: str):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.script = script
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.backoff = 1.0
+    
+    def start(self):
+        env = dict(os.environ)
+        env["SHARD_COUNT"] = str(self.shard_count)
+        env["CLUSTER_SHARD_IDS"] = ",".join(map(str, self.shard_ids))
+        env["CLUSTER_ID"] = str(self.cluster_id)
+        self.process = subprocess.Popen([sys.executable, self.script], env=env)
+        self.started_at = time.monotonic()
+        logging.info(f"🚀 Кластер {self.cluster_id}: шарды {self.shard_ids[0]}-{self.shard_ids[-1]}, pid {self.process.pid}")
+    
+    def check(self):
+        """Перезапустить процесс, если он завершился"""
+        now = time.monotonic()
+        if self.process is None:
+            if now >= self.restart_at:
+                self.start()
+            return
+        
+        code = self.process.poll()
+        if code is None:
+            return
+        if now - self.started_at >= HEALTHY_UPTIME:
+            self.backoff = 1.0
+        logging.warning(f"⚠️ Кластер {self.cluster_id} завершился с кодом {code}, перезапуск через {self.backoff:.0f} с")
+        self.process = None
+        self.restart_at = now + self.backoff
+        self.backoff = min(RESTART_BACKOFF_MAX, self.backoff * 2)
+    
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clusters", type=int, default=os.cpu_count() or 1, help="число процессов")
+    parser.add_argument("--shards", type=int, help="всего шардов (по умолчанию — рекомендация Discord)")
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixed.py"))
+    args = parser.parse_args()
+    
+    shard_count = args.shards
+    if not shard_count:
+        token = os.getenv("DISCORD_TOKEN")
+        if not token:
+            parser.error("нужен --shards или DISCORD_TOKEN для запроса рекомендации")
+        shard_count = recommended_shards(token)
+    
+    clusters = [
+        Cluster(i, shard_ids, shard_count, args.script)
+        for i, shard_ids in enumerate(split_shards(shard_count, args.clusters))
+    ]
+    logging.info(f"🔷 Шардов: {shard_count}, процессов: {len(clusters)}")
+    
+    stopping = False
+    
+    def on_signal(signum, _frame):
+        nonlocal stopping
+        stopping = True
+    
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    
+    for cluster in clusters:
+        cluster.start()
+        # Discord ограничивает частоту IDENTIFY — процессы стартуют по очереди
+        time.sleep(5)
+    
+    while not stopping:
+        for cluster in clusters:
+            cluster.check()
+        time.sleep(1)
+    
+    logging.info("🛑 Остановка кластеров")
+    for cluster in clusters:
+        cluster.stop()
+    for cluster in clusters:
+        if cluster.process:
+            try:
+                cluster.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                cluster.process.kill()
+
+
+if __name__ == "__main__":
+    main()
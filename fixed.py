@@ -1,11 +1,25 @@
 import asyncio
 import copy
+import hashlib
+import heapq
+import json
 import logging
+import math
 import os
+import random
 import re
+import signal
+import sqlite3
+import threading
 import time
+import uuid
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import timedelta
 from typing import Optional, List, Tuple, Dict
 from functools import partial
+from urllib.parse import urlparse, parse_qs
 
 import discord
 import yt_dlp
@@ -14,13 +28,84 @@ from discord.ext import commands
 from discord.ui import View, Button, Select, Modal, TextInput
 from discord import ButtonStyle
 
+try:
+    import numpy as np
+except ImportError:  # DSP-стадия необязательна
+    np = None
+
 # --- Инициализация бота ---
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 intents.voice_states = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Шардинг: без SHARD_COUNT число шардов выбирает Discord.
+# В кластере (cluster.py) каждый процесс получает свой список CLUSTER_SHARD_IDS.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+CLUSTER_SHARD_IDS = [int(x) for x in os.getenv("CLUSTER_SHARD_IDS", "").split(",") if x.strip()] or None
+CLUSTER_ID = os.getenv("CLUSTER_ID", "0")
+
+
+class ShardedBot(commands.AutoShardedBot):
+    """Бот с автоматическим шардингом и счётчиком событий по шардам"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # шард -> [номер минуты, событий за неё, событий за предыдущую]
+        self.shard_events: Dict[int, list] = {}
+    
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        shard_id = _event_shard(event_name, args)
+        if shard_id is not None:
+            minute = int(time.monotonic() // 60)
+            bucket = self.shard_events.get(shard_id)
+            if bucket is None or bucket[0] != minute:
+                prev = bucket[1] if bucket and bucket[0] == minute - 1 else 0
+                bucket = self.shard_events[shard_id] = [minute, 0, prev]
+            bucket[1] += 1
+        super().dispatch(event_name, *args, **kwargs)
+    
+    async def setup_hook(self):
+        # настройки загружаются до подключения к шлюзу
+        await start_state_sync()
+    
+    async def close(self):
+        # последний снимок плееров уходит вместе с остальными отложенными записями
+        snapshot_players()
+        await close_shared_state()
+        await super().close()
+    
+    def events_per_minute(self, shard_id: int) -> int:
+        bucket = self.shard_events.get(shard_id)
+        if bucket is None:
+            return 0
+        minute = int(time.monotonic() // 60)
+        if bucket[0] == minute:
+            return bucket[2] or bucket[1]
+        return bucket[1] if bucket[0] == minute - 1 else 0
+
+
+def shard_of(guild_id: int) -> int:
+    """Номер шарда, который обслуживает сервер"""
+    return (guild_id >> 22) % (bot.shard_count or 1)
+
+
+def _event_shard(event_name: str, args: tuple) -> Optional[int]:
+    if event_name.startswith("shard_") and args and isinstance(args[0], int):
+        return args[0]
+    for arg in args[:2]:
+        if isinstance(arg, discord.Guild):
+            return arg.shard_id
+        guild = getattr(arg, "guild", None)
+        if isinstance(guild, discord.Guild):
+            return guild.shard_id
+        guild_id = getattr(arg, "guild_id", None)
+        if isinstance(guild_id, int):
+            return shard_of(guild_id)
+    return None
+
+
+bot = ShardedBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=CLUSTER_SHARD_IDS)
 tree = bot.tree
 
 # --- Логирование ---
@@ -30,9 +115,22 @@ logging.basicConfig(
 )
 
 # --- Глобальные переменные ---
-user_message_history = {}
 SPAM_THRESHOLD = 5
 SPAM_TIME_WINDOW = 4
+# как часто выбрасывать из счётчика спама авторов, молчащих дольше окна
+SPAM_EVICT_INTERVAL = 60
+# автомут выполняют фоновые воркеры; сервер всегда попадает к одному и тому же
+MUTE_WORKERS = 4
+MUTE_QUEUE_MAX = 1000
+# Как мьютить: "timeout" — встроенный тайм-аут Discord (один запрос, снимается
+# сервером Discord, до 28 дней), "role" — роль Muted с таймером бота
+MUTE_BACKEND_DEFAULT = "timeout"
+MUTE_TIMEOUT_MAX = timedelta(days=28)
+# предел /mute в минутах (дольше 28 дней — только ролью)
+MUTE_MINUTES_MAX = 365 * 24 * 60
+# права роли Muted: сколько каналов настраивать одновременно и как часто сообщать прогресс
+MUTED_OVERWRITE_CONCURRENCY = 5
+MUTED_PROGRESS_INTERVAL = 5
 MUTE_DURATION = 2 * 60 * 60
 
 user_temp_vcs = {}
@@ -46,6 +144,14 @@ welcome_settings = {}
 
 MOD_ROLE_RANKS: Dict[int, Dict[int, int]] = {}
 LOCK_SNAPSHOTS: Dict[int, Dict[int, Dict[str, dict]]] = {}
+# сервер -> участник -> {"until": unix-время снятия мута, "notify": писать ли в ЛС}
+mute_timers: Dict[int, Dict[int, dict]] = {}
+# сервер -> способ мута ("timeout" / "role"), если отличается от MUTE_BACKEND_DEFAULT
+mute_backends: Dict[int, str] = {}
+# сервер -> снимок плеера (позиция, громкость, каналы) для продолжения после перезапуска
+player_snapshots: Dict[int, dict] = {}
+# сервер -> очередь плеера из снимка; отдельно, чтобы не переписывать её каждый тик
+player_queues: Dict[int, list] = {}
 
 # --- Музыкальные настройки ---
 music_players: Dict[int, "MusicPlayer"] = {}
@@ -57,7 +163,102 @@ YTDLP_STREAM_OPTS = {
     "no_warnings": True,
     "source_address": "0.0.0.0",
     "geo_bypass": True,
+    "socket_timeout": 10,
+}
+
+# Плейлисты: плоское извлечение, записи отдаются по мере получения
+YTDLP_PLAYLIST_OPTS = {
+    **YTDLP_STREAM_OPTS,
+    "noplaylist": False,
+    "extract_flat": "in_playlist",
+    "lazy_playlist": True,
 }
+PLAYLIST_MAX_TRACKS = 5000
+PLAYLIST_BUFFER = 50
+# обход плейлиста держит поток до конца — у них свой пул, чтобы не отнимать потоки у /play
+PLAYLIST_INGEST_WORKERS = 2
+
+# /play с несколькими запросами (через ";" или с новой строки)
+BATCH_MAX_QUERIES = 25
+BATCH_RESOLVE_CONCURRENCY = 4
+
+# Пул извлечения yt_dlp: ограниченное число потоков и очередь ожидания
+YTDLP_EXTRACT_WORKERS = 4
+YTDLP_EXTRACT_TIMEOUT = 20
+YTDLP_MAX_PENDING = 16
+YTDLP_QUEUE_WAIT = 5
+
+# Кэш извлечённых треков (общий для всех серверов)
+TRACK_CACHE_SIZE = 1024
+TRACK_CACHE_TTL = 6 * 60 * 60
+TRACK_CACHE_EXPIRE_MARGIN = 5 * 60
+
+# Сколько следующих треков очереди резолвить заранее
+PREFETCH_AHEAD = 2
+
+# Прогрев FFmpeg следующего трека: за сколько секунд до конца текущего
+# открывать источник и сколько готовый источник может ждать своей очереди
+PREWARM_LEAD = 15
+WARM_SOURCE_MAX_AGE = 45
+FFMPEG_EXECUTABLE = "/usr/bin/ffmpeg"
+
+# Громкость по умолчанию (как и раньше, 50%); Opus идёт в войс без перекодирования
+# только когда пользователь сам выставил 100%
+MUSIC_DEFAULT_VOLUME = 0.5
+
+# Локальный кэш популярных треков (Opus-файлы на диске); без каталога выключен
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR") or None
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3
+AUDIO_CACHE_MIN_PLAYS = 3
+AUDIO_CACHE_MAX_DURATION = 15 * 60
+AUDIO_CACHE_WORKERS = 2
+
+# DSP-стадия (нужен numpy): кроссфейд между треками и выравнивание громкости.
+# Если что-то из этого включено, звук всегда идёт через PCM.
+MUSIC_CROSSFADE_SECONDS = 0
+MUSIC_NORMALIZE = False
+DSP_TARGET_RMS = 0.12
+DSP_SOFT_CLIP_KNEE = 0.85
+
+# Повторы и размыкатель: сколько раз пробовать трек, что считать обрывом
+# на старте и когда временно перестать ходить к отказавшему хосту.
+# Размыкатель общий для всех серверов процесса, поэтому срабатывает по доле
+# отказов за окно, а не по их числу
+TRACK_MAX_ATTEMPTS = 3
+TRACK_RETRY_BACKOFF = 0.5
+TRACK_EARLY_EXIT = 2.0
+BREAKER_MIN_FAILURES = 20
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_WINDOW = 60
+BREAKER_COOLDOWN = 60
+DEAD_TRACKS_LIMIT = 5000
+
+# Подсказки /play: сколько недавних треков держать в локальном индексе,
+# пауза перед удалённым поиском и его предел (Discord ждёт ответ 3 секунды)
+AUTOCOMPLETE_INDEX_SIZE = 5000
+AUTOCOMPLETE_DEBOUNCE = 0.6
+AUTOCOMPLETE_REMOTE_TIMEOUT = 1.8
+AUTOCOMPLETE_REMOTE_RESULTS = 5
+# у подсказок свой маленький пул, чтобы не занимать слоты извлечения для /play
+AUTOCOMPLETE_SEARCH_WORKERS = 2
+
+# Сборщик: когда отключать простаивающие плееры и как часто проверять
+MUSIC_IDLE_TIMEOUT = 5 * 60
+# пауза — не простой: слушатели ставят её намеренно
+MUSIC_PAUSED_TIMEOUT = 60 * 60
+MUSIC_ALONE_TIMEOUT = 2 * 60
+MUSIC_DISCONNECTED_GRACE = 60
+REAPER_INTERVAL = 30
+ORPHAN_FFMPEG_MIN_AGE = 60
+
+# Снимки плееров для продолжения после перезапуска: как часто сохранять,
+# сколько треков очереди хранить и через сколько снимок считать устаревшим
+PLAYER_SNAPSHOT_INTERVAL = 15
+PLAYER_SNAPSHOT_MAX_TRACKS = 1000
+PLAYER_SNAPSHOT_MAX_AGE = 60 * 60
+
+# Панель управления: изменения за это окно собираются в одно редактирование
+CONTROL_UPDATE_DELAY = 1.5
 
 FFMPEG_OPTIONS = {
     "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
@@ -67,6 +268,267 @@ FFMPEG_OPTIONS = {
 
 DEFAULT_WELCOME = "👋 Привет, {user}! Добро пожаловать на сервер **{server}**! 🎉"
 
+# Хранилище настроек серверов (sqlite / memory / none): где хранить,
+# сколько копить изменения перед записью и как часто кластер забирает чужие
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "bot_state.sqlite3")
+STATE_FLUSH_DELAY = 1.0
+STATE_POLL_INTERVAL = 5
+
+# ============================================================================
+# ОБЩЕЕ СОСТОЯНИЕ
+# ============================================================================
+
+# пространство имён -> словарь настроек по серверам
+SHARED_STATE: Dict[str, dict] = {
+    "server_settings": server_settings,
+    "log_channels": log_channels,
+    "admin_roles": admin_roles,
+    "support_roles": support_roles,
+    "welcome_settings": welcome_settings,
+    "mod_role_ranks": MOD_ROLE_RANKS,
+    "lock_snapshots": LOCK_SNAPSHOTS,
+    "mute_timers": mute_timers,
+    "mute_backends": mute_backends,
+    "player_snapshots": player_snapshots,
+    "player_queues": player_queues,
+}
+
+
+class StateBackend:
+    """Хранилище общего состояния: (пространство имён, сервер) -> JSON с номером версии"""
+    
+    def write(self, namespace: str, guild_id: int, value: Optional[str], origin: str):
+        """Записать значение; None — удалить"""
+        raise NotImplementedError
+    
+    def write_many(self, rows: List[Tuple[str, int, Optional[str]]], origin: str):
+        for namespace, guild_id, value in rows:
+            self.write(namespace, guild_id, value, origin)
+    
+    def changes_since(self, version: int) -> List[Tuple[str, int, Optional[str], str, int]]:
+        """Изменения с версией больше version: (ns, сервер, значение, источник, версия)"""
+        raise NotImplementedError
+    
+    def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """Хранилище в памяти процесса (для одиночного запуска и проверок)"""
+    
+    def __init__(self):
+        self._rows: Dict[Tuple[str, int], Tuple[Optional[str], str, int]] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+    
+    def write(self, namespace: str, guild_id: int, value: Optional[str], origin: str):
+        with self._lock:
+            self._version += 1
+            self._rows[(namespace, guild_id)] = (value, origin, self._version)
+    
+    def changes_since(self, version: int) -> List[Tuple[str, int, Optional[str], str, int]]:
+        with self._lock:
+            rows = [(ns, gid, value, origin, v) for (ns, gid), (value, origin, v) in self._rows.items() if v > version]
+        rows.sort(key=lambda row: row[4])
+        return rows
+
+
+class SQLiteStateBackend(StateBackend):
+    """Хранилище в файле SQLite: общее для всех процессов на одной машине"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " namespace TEXT NOT NULL, guild_id INTEGER NOT NULL, value TEXT,"
+            " origin TEXT NOT NULL, version INTEGER NOT NULL,"
+            " PRIMARY KEY (namespace, guild_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS state_version ON state (version)")
+    
+    def write(self, namespace: str, guild_id: int, value: Optional[str], origin: str):
+        self.write_many([(namespace, guild_id, value)], origin)
+    
+    def write_many(self, rows: List[Tuple[str, int, Optional[str]]], origin: str):
+        """Все строки — одной транзакцией"""
+        with self._lock:
+            # BEGIN IMMEDIATE: версия растёт строго, даже когда пишут несколько процессов
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for namespace, guild_id, value in rows:
+                    self._db.execute(
+                        "INSERT INTO state (namespace, guild_id, value, origin, version)"
+                        " VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM state))"
+                        " ON CONFLICT (namespace, guild_id) DO UPDATE SET"
+                        " value = excluded.value, origin = excluded.origin, version = excluded.version",
+                        (namespace, guild_id, value, origin),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+    
+    def changes_since(self, version: int) -> List[Tuple[str, int, Optional[str], str, int]]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT namespace, guild_id, value, origin, version FROM state"
+                " WHERE version > ? ORDER BY version",
+                (version,),
+            ).fetchall()
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _make_state_backend() -> Optional[StateBackend]:
+    if STATE_BACKEND == "none":
+        return None
+    if STATE_BACKEND == "memory":
+        return MemoryStateBackend()
+    return SQLiteStateBackend(STATE_DB_PATH)
+
+
+# создаётся в start_state_sync, а не при импорте: import fixed (бенчмарки) не трогает диск
+state_backend: Optional[StateBackend] = None
+# свой для каждого запуска: PID в контейнере от запуска к запуску одинаковый
+_state_origin = f"{CLUSTER_ID}:{uuid.uuid4().hex}"
+_state_version = 0
+_state_sync_task: Optional[asyncio.Task] = None
+# один поток: записи и чтения хранилища идут строго по порядку и не держат цикл событий
+_state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+_state_dirty: set = set()
+_state_flush_handle: Optional[asyncio.TimerHandle] = None
+_state_flush_task: Optional[asyncio.Task] = None
+
+
+def _restore_keys(value):
+    """JSON делает ключи строками — ID (цифры) возвращаем в int"""
+    if isinstance(value, dict):
+        return {int(k) if isinstance(k, str) and k.isdigit() else k: _restore_keys(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_restore_keys(v) for v in value]
+    return value
+
+
+def _publish(namespace: str, guild_id: int):
+    """Отметить настройки сервера изменёнными; запись уйдёт пачкой через STATE_FLUSH_DELAY"""
+    if STATE_BACKEND == "none":
+        return
+    _state_dirty.add((namespace, guild_id))
+    _arm_state_flush()
+
+
+def _arm_state_flush():
+    global _state_flush_handle
+    if _state_flush_handle is None:
+        loop = asyncio.get_running_loop()
+        _state_flush_handle = loop.call_later(STATE_FLUSH_DELAY, _schedule_state_flush)
+
+
+def _schedule_state_flush():
+    global _state_flush_handle, _state_flush_task
+    _state_flush_handle = None
+    if _state_flush_task is None or _state_flush_task.done():
+        _state_flush_task = asyncio.create_task(flush_shared_state())
+    else:
+        # запись ещё идёт — новые изменения заберёт следующий проход
+        _state_flush_handle = asyncio.get_running_loop().call_later(STATE_FLUSH_DELAY, _schedule_state_flush)
+
+
+async def flush_shared_state() -> int:
+    """Записать накопленные изменения одной транзакцией"""
+    if state_backend is None or not _state_dirty:
+        return 0
+    # сериализуем в цикле событий: словари не меняются посреди json.dumps
+    rows = []
+    for namespace, guild_id in _state_dirty:
+        value = SHARED_STATE[namespace].get(guild_id)
+        rows.append((namespace, guild_id, None if value is None else json.dumps(value)))
+    _state_dirty.clear()
+    
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(_state_executor, state_backend.write_many, rows, _state_origin)
+    except Exception as e:
+        logging.error(f"Не удалось сохранить настройки ({len(rows)} записей): {e}")
+        # повторим позже; значения возьмутся свежие на момент записи
+        _state_dirty.update((namespace, guild_id) for namespace, guild_id, _ in rows)
+        _arm_state_flush()
+        return 0
+    return len(rows)
+
+
+def _apply_state_changes(rows, skip_own: bool) -> int:
+    global _state_version
+    applied = 0
+    for namespace, guild_id, value, origin, version in rows:
+        _state_version = max(_state_version, version)
+        store = SHARED_STATE.get(namespace)
+        if store is None or (skip_own and origin == _state_origin):
+            continue
+        if value is None:
+            store.pop(guild_id, None)
+        else:
+            store[guild_id] = _restore_keys(json.loads(value))
+        applied += 1
+    return applied
+
+
+async def sync_shared_state(skip_own: bool = True) -> int:
+    """Забрать изменения других процессов; вернуть число применённых"""
+    if state_backend is None:
+        return 0
+    loop = asyncio.get_running_loop()
+    rows = await loop.run_in_executor(_state_executor, state_backend.changes_since, _state_version)
+    return _apply_state_changes(rows, skip_own)
+
+
+async def _state_sync_loop():
+    # устаревание чужих изменений ограничено интервалом опроса
+    while True:
+        await asyncio.sleep(STATE_POLL_INTERVAL)
+        try:
+            await sync_shared_state()
+        except Exception as e:
+            logging.error(f"Ошибка синхронизации состояния: {e}")
+
+
+async def start_state_sync():
+    """Загрузить сохранённые настройки; в кластере — следить за чужими изменениями"""
+    global _state_sync_task, state_backend
+    if STATE_BACKEND == "none" or (_state_sync_task and not _state_sync_task.done()):
+        return
+    if state_backend is None:
+        state_backend = await asyncio.get_running_loop().run_in_executor(_state_executor, _make_state_backend)
+    # словари в памяти — кэш хранилища: горячие проверки не ходят в базу
+    # первая загрузка применяет всё, включая записи прошлых запусков этого процесса
+    loaded = await sync_shared_state(skip_own=False)
+    logging.info(f"🗄 Настройки серверов: загружено записей {loaded} (кластер {CLUSTER_ID})")
+    if _state_dirty:
+        # изменения, отмеченные до появления хранилища
+        _arm_state_flush()
+    if CLUSTER_SHARD_IDS:
+        _state_sync_task = asyncio.create_task(_state_sync_loop())
+
+
+async def close_shared_state():
+    """Дописать отложенные изменения перед выходом"""
+    if _state_sync_task:
+        _state_sync_task.cancel()
+    if _state_flush_handle:
+        _state_flush_handle.cancel()
+    if _state_flush_task and not _state_flush_task.done():
+        await _state_flush_task
+    await flush_shared_state()
+    if state_backend is not None:
+        await asyncio.get_running_loop().run_in_executor(_state_executor, state_backend.close)
+
 # ============================================================================
 # УТИЛИТЫ
 # ============================================================================
@@ -172,238 +634,2410 @@ def _build_welcome_embed(guild: discord.Guild, text: str) -> discord.Embed:
 
 
 # ============================================================================
-# МУЗЫКАЛЬНЫЙ ПЛЕЕР
+# ИЗВЛЕЧЕНИЕ ТРЕКОВ (yt_dlp)
 # ============================================================================
 
-class MusicPlayer:
-    """Музыкальный плеер для сервера"""
+class ExtractorBusy(Exception):
+    """Пул извлечения переполнен"""
+
+
+_ytdl_executor = ThreadPoolExecutor(max_workers=YTDLP_EXTRACT_WORKERS, thread_name_prefix="ytdl")
+_ytdl_slots = asyncio.Semaphore(YTDLP_EXTRACT_WORKERS + YTDLP_MAX_PENDING)
+
+
+def _release_ytdl_slot(loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore = _ytdl_slots):
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        # цикл уже закрыт — бот завершается
+        pass
+
+
+async def run_extraction(func, *args):
+    """Выполнить блокирующий вызов yt_dlp в отдельном пуле с таймаутом"""
+    try:
+        await asyncio.wait_for(_ytdl_slots.acquire(), timeout=YTDLP_QUEUE_WAIT)
+    except asyncio.TimeoutError:
+        raise ExtractorBusy() from None
     
-    def __init__(self, guild: discord.Guild, vc: discord.VoiceClient,
-                 text_channel: discord.abc.Messageable):
-        self.guild = guild
-        self.vc = vc
-        self.text_channel = text_channel
-        self.volume = 0.5
-        self.current_source: Optional[discord.PCMVolumeTransformer] = None
-        self.queue: List[Tuple[str, str, Optional[str]]] = []
-        self.current_track: Optional[Tuple[str, str, Optional[str]]] = None
-        self.control_message: Optional[discord.Message] = None
-        self._play_lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+    try:
+        cfut = _ytdl_executor.submit(func, *args)
+    except BaseException:
+        _ytdl_slots.release()
+        raise
+    
+    # слот освобождается только когда поток действительно закончил работу,
+    # иначе зависшие запросы незаметно переполнят пул
+    cfut.add_done_callback(lambda _: _release_ytdl_slot(loop))
+    
+    # отмена/таймаут снимает ещё не начатую задачу с очереди пула
+    return await asyncio.wait_for(asyncio.wrap_future(cfut), timeout=YTDLP_EXTRACT_TIMEOUT)
 
-    async def add_track(self, query: str) -> Tuple[bool, str]:
-        """Добавить трек в очередь с корректным потоком для FFmpeg"""
-        try:
-            search_query = query if query.startswith(("http://", "https://")) else f"ytsearch1:{query}"
 
-            with yt_dlp.YoutubeDL(YTDLP_STREAM_OPTS) as ydl:
-                info = ydl.extract_info(search_query, download=False)
+def _extract_info_sync(search_query: str, opts: dict) -> dict:
+    """Синхронное извлечение (выполняется в потоке пула)"""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.extract_info(search_query, download=False)
 
-                # Если это поиск, берем первый результат
-                if "entries" in info:
-                    info = info["entries"][0]
 
-                # Получаем URL для потока без видео
-                formats = info.get("formats", [info])
-                audio_format = next(
-                    (f for f in formats if f.get("acodec") != "none" and f.get("vcodec") == "none"),
-                    None
-                )
-                if not audio_format or not audio_format.get("url"):
-                    return False, "❌ Не удалось получить поток для FFmpeg"
+_PLAYLIST_END = object()
+_playlist_executor = ThreadPoolExecutor(max_workers=PLAYLIST_INGEST_WORKERS, thread_name_prefix="playlist")
+_playlist_slots = asyncio.Semaphore(PLAYLIST_INGEST_WORKERS)
 
-                title = info.get("title", "Unknown")
-                stream_url = audio_format["url"]
-                thumbnail = info.get("thumbnail")
 
-                self.queue.append((title, stream_url, thumbnail))
-                return True, f"➕ **{title}** добавлен в очередь"
+def _is_playlist_url(query: str) -> bool:
+    if not query.startswith(("http://", "https://")):
+        return False
+    parsed = urlparse(query)
+    params = parse_qs(parsed.query)
+    if parsed.path.rstrip("/").endswith("/playlist"):
+        return True
+    if "list" in params and "v" not in params:
+        return True
+    return "/sets/" in parsed.path
+
 
-        except Exception as e:
-            logging.error(f"Ошибка добавления трека: {e}")
-            return False, f"❌ Ошибка: {str(e)}"
+def _offer_entry(loop: asyncio.AbstractEventLoop, buffer: asyncio.Queue, item, stop: threading.Event) -> bool:
+    """Положить запись в буфер, блокируя поток пула, пока в буфере нет места"""
+    fut = asyncio.run_coroutine_threadsafe(buffer.put(item), loop)
+    while True:
+        try:
+            fut.result(timeout=1)
+            return True
+        except FuturesTimeout:
+            if stop.is_set():
+                fut.cancel()
+                return False
 
-    async def play_next(self):
-        """Воспроизвести следующий трек"""
-        async with self._play_lock:
-            if not self.queue:
-                await self.stop_and_cleanup()
-                return
+
+def _pump_playlist_sync(url: str, limit: int, loop: asyncio.AbstractEventLoop,
+                        buffer: asyncio.Queue, stop: threading.Event):
+    """Извлечь плейлист в потоке пула и передавать записи в цикл событий"""
+    try:
+        with yt_dlp.YoutubeDL(YTDLP_PLAYLIST_OPTS) as ydl:
+            # process=False оставляет entries ленивым генератором
+            info = ydl.extract_info(url, download=False, process=False)
+            entries = info.get("entries")
+            if entries is None:
+                entries = [info]
             
-            title, stream_url, thumbnail = self.queue.pop(0)
-            self.current_track = (title, stream_url, thumbnail)
+            for count, entry in enumerate(entries):
+                if count >= limit or stop.is_set():
+                    break
+                if entry and not _offer_entry(loop, buffer, entry, stop):
+                    break
+    except Exception as e:
+        _offer_entry(loop, buffer, e, stop)
+    finally:
+        _offer_entry(loop, buffer, _PLAYLIST_END, stop)
 
-            try:
-                source = await discord.FFmpegOpusAudio.from_probe(
-                    stream_url,
-                    executable="/usr/bin/ffmpeg",
-                    options="-vn"
-                )
-                self.current_source = discord.PCMVolumeTransformer(source, volume=self.volume)
-            except Exception as e:
-                logging.error(f"FFmpeg ошибка: {e}")
-                await self.play_next()
+
+async def iter_playlist(url: str, limit: int = PLAYLIST_MAX_TRACKS):
+    """Асинхронно отдавать записи плейлиста по мере их извлечения"""
+    try:
+        await asyncio.wait_for(_playlist_slots.acquire(), timeout=YTDLP_QUEUE_WAIT)
+    except asyncio.TimeoutError:
+        raise ExtractorBusy() from None
+    
+    loop = asyncio.get_running_loop()
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=PLAYLIST_BUFFER)
+    stop = threading.Event()
+    try:
+        cfut = _playlist_executor.submit(_pump_playlist_sync, url, limit, loop, buffer, stop)
+    except BaseException:
+        _playlist_slots.release()
+        raise
+    cfut.add_done_callback(lambda _: _release_ytdl_slot(loop, _playlist_slots))
+    
+    try:
+        while True:
+            # зависший источник не держит обход бесконечно
+            item = await asyncio.wait_for(buffer.get(), timeout=YTDLP_EXTRACT_TIMEOUT)
+            if item is _PLAYLIST_END:
                 return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # освобождаем поток, если он ждёт места в буфере
+        while not buffer.empty():
+            buffer.get_nowait()
 
-            def after_playing(error):
-                if error:
-                    logging.error(f"Ошибка воспроизведения: {error}")
-                
-                coro = self.play_next()
-                asyncio.run_coroutine_threadsafe(coro, bot.loop)
-            
-            try:
-                self.vc.play(source, after=after_playing)
-                await self.update_control_message()
-            except Exception as e:
-                logging.error(f"Ошибка vc.play: {e}")
-                await self.play_next()
+
+# ============================================================================
+# КЭШ ТРЕКОВ
+# ============================================================================
+
+_YT_ID_RE = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/)|youtu\.be/)([\w-]{11})")
+_EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d+)")
+
+
+class ResolvedTrack:
+    """Результат извлечения: метаданные и выбранный аудиоформат"""
     
-    async def stop_and_cleanup(self):
-        """Остановить плеер и очистить ресурсы"""
-        try:
-            if self.vc and self.vc.is_connected():
-                await self.vc.disconnect(force=True)
-        except Exception as e:
-            logging.error(f"Ошибка отключения: {e}")
-        
-        if self.control_message:
-            try:
-                await self.control_message.edit(view=None)
-                await self.control_message.delete()
-            except Exception:
-                pass
-        
-        self.current_track = None
-        self.current_source = None
-        self.queue.clear()
+    __slots__ = ("video_id", "title", "thumbnail", "duration", "webpage_url",
+                 "stream_url", "format_id", "acodec", "abr", "expires_at")
     
-    async def update_control_message(self):
-        """Обновить панель управления"""
-        if self.vc.is_playing():
-            status = "▶️ Воспроизведение"
-        elif self.vc.is_paused():
-            status = "⏸ Пауза"
-        else:
-            status = "❌ Не играет"
-        
-        current_title = self.current_track[0] if self.current_track else "Нет трека"
-        
-        queue_lines = []
-        for i, track in enumerate(self.queue[:10], 1):
-            queue_lines.append(f"{i}. {track[0]}")
-        queue_text = "\n".join(queue_lines) or "Очередь пуста"
-        
-        vol_pct = int(self.volume * 100)
-        description = (
-            f"**Сейчас играет:** {current_title}\n\n"
-            f"📃 **Очередь ({len(self.queue)}):**\n{queue_text}\n\n"
-            f"🔊 **Громкость:** {vol_pct}%"
-        )
-        
-        embed = discord.Embed(
-            title=f"🎶 Музыкальный плеер — {status}",
-            description=description,
-            color=discord.Color.green()
-        )
+    def __init__(self, video_id: Optional[str], title: str, thumbnail: Optional[str],
+                 duration: Optional[float], webpage_url: Optional[str], stream_url: str,
+                 format_id: Optional[str], acodec: Optional[str], abr: Optional[float],
+                 expires_at: float):
+        self.video_id = video_id
+        self.title = title
+        self.thumbnail = thumbnail
+        self.duration = duration
+        self.webpage_url = webpage_url
+        self.stream_url = stream_url
+        self.format_id = format_id
+        self.acodec = acodec
+        self.abr = abr
+        self.expires_at = expires_at
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _canonical_video_id(query: str) -> Optional[str]:
+    m = _YT_ID_RE.search(query)
+    return m.group(1) if m else None
+
+
+def _stream_expires_at(stream_url: str) -> float:
+    """Время, до которого подписанная ссылка на поток ещё живая"""
+    now = time.time()
+    deadline = now + TRACK_CACHE_TTL
+    
+    expire = parse_qs(urlparse(stream_url).query).get("expire", [None])[0]
+    if expire is None:
+        m = _EXPIRE_RE.search(stream_url)
+        expire = m.group(1) if m else None
+    
+    if expire and expire.isdigit():
+        deadline = min(deadline, int(expire) - TRACK_CACHE_EXPIRE_MARGIN)
+    return deadline
+
+
+def _resolved_from_info(info: dict) -> Optional[ResolvedTrack]:
+    """Выбрать аудиоформат из ответа yt_dlp"""
+    formats = info.get("formats", [info])
+    audio_format = next(
+        (f for f in formats if f.get("acodec") != "none" and f.get("vcodec") == "none"),
+        None
+    )
+    if not audio_format or not audio_format.get("url"):
+        return None
+    
+    stream_url = audio_format["url"]
+    return ResolvedTrack(
+        video_id=info.get("id"),
+        title=info.get("title", "Unknown"),
+        thumbnail=info.get("thumbnail"),
+        duration=info.get("duration"),
+        webpage_url=info.get("webpage_url"),
+        stream_url=stream_url,
+        format_id=audio_format.get("format_id"),
+        acodec=audio_format.get("acodec"),
+        abr=audio_format.get("abr"),
+        expires_at=_stream_expires_at(stream_url),
+    )
+
+
+class TrackCache:
+    """LRU-кэш треков с TTL по запросу и по ID видео"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[str, ResolvedTrack]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _query_key(query: str) -> str:
+        video_id = _canonical_video_id(query)
+        if video_id:
+            return f"id:{video_id}"
+        return f"q:{_normalize_query(query)}"
+    
+    def get(self, query: str) -> Optional[ResolvedTrack]:
+        key = self._query_key(query)
+        track = self._items.get(key)
+        if track is None:
+            self.misses += 1
+            return None
         
-        if self.current_track and self.current_track[2]:
-            embed.set_thumbnail(url=self.current_track[2])
+        if track.expires_at <= time.time():
+            del self._items[key]
+            self.misses += 1
+            return None
         
-        view = MusicControlView()
+        self._items.move_to_end(key)
+        self.hits += 1
+        return track
+    
+    def put(self, query: str, track: ResolvedTrack):
+        keys = {self._query_key(query)}
+        if track.video_id:
+            keys.add(f"id:{track.video_id}")
         
-        if self.control_message:
-            try:
-                await self.control_message.edit(embed=embed, view=view)
-                return
-            except Exception:
-                self.control_message = None
+        for key in keys:
+            self._items[key] = track
+            self._items.move_to_end(key)
         
-        try:
-            self.control_message = await self.text_channel.send(embed=embed, view=view)
-        except Exception as e:
-            logging.error(f"Ошибка отправки панели: {e}")
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
     
-    def pause(self):
-        if self.vc and self.vc.is_playing():
-            self.vc.pause()
+    def invalidate(self, video_id: str):
+        """Выбросить трек (и все запросы, которые на него указывают)"""
+        stale = [k for k, t in self._items.items() if t.video_id == video_id]
+        for k in stale:
+            del self._items[k]
+
+
+track_cache = TrackCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)
+_inflight_resolves: Dict[str, asyncio.Task] = {}
+
+
+class Track:
+    """Элемент очереди: описание трека без привязки к ссылке на поток"""
     
-    def resume(self):
-        if self.vc and self.vc.is_paused():
-            self.vc.resume()
+    __slots__ = ("lookup", "title", "thumbnail", "duration", "video_id", "resolved", "failures", "start_at")
     
-    def stop(self):
-        if self.vc and (self.vc.is_playing() or self.vc.is_paused()):
-            self.vc.stop()
+    def __init__(self, lookup: str, title: str = "Unknown", thumbnail: Optional[str] = None,
+                 duration: Optional[float] = None, video_id: Optional[str] = None):
+        self.lookup = lookup
+        self.title = title
+        self.thumbnail = thumbnail
+        self.duration = duration
+        self.video_id = video_id
+        self.resolved: Optional[ResolvedTrack] = None
+        self.failures = 0
+        # с какой секунды начать (продолжение после обрыва или перемотки)
+        self.start_at = 0.0
+    
+    @property
+    def key(self) -> str:
+        return self.video_id or self.lookup
+    
+    @property
+    def needs_resolve(self) -> bool:
+        return self.resolved is None or self.resolved.expires_at <= time.time()
+    
+    def describe(self) -> list:
+        """Компактное описание для снимка плеера (без ссылки на поток)"""
+        return [self.lookup, self.title, self.duration, self.video_id]
+    
+    @classmethod
+    def from_description(cls, data: list) -> "Track":
+        lookup, title, duration, video_id = data
+        return cls(lookup, title=title, duration=duration, video_id=video_id)
+    
+    def apply(self, resolved: ResolvedTrack):
+        self.resolved = resolved
+        self.title = resolved.title
+        self.thumbnail = resolved.thumbnail or self.thumbnail
+        self.duration = resolved.duration or self.duration
+        self.video_id = resolved.video_id or self.video_id
+        # дальше резолвим по постоянной ссылке, а не по поисковому запросу
+        if resolved.webpage_url:
+            self.lookup = resolved.webpage_url
 
 
-class MusicControlView(View):
-    """Панель управления музыкой"""
+def _track_from_entry(entry: dict) -> Optional[Track]:
+    """Трек из плоской записи плейлиста (ссылка на поток будет получена позже)"""
+    video_id = entry.get("id")
+    url = entry.get("url") or entry.get("webpage_url")
+    if url and not url.startswith(("http://", "https://")):
+        url = None
+    if not url and video_id and entry.get("ie_key", "Youtube") == "Youtube":
+        url = f"https://www.youtube.com/watch?v={video_id}"
+    if not url:
+        return None
+    
+    title = entry.get("title") or "Unknown"
+    if title in ("[Private video]", "[Deleted video]"):
+        return None
+    
+    thumbnail = entry.get("thumbnail")
+    if not thumbnail and entry.get("thumbnails"):
+        thumbnail = entry["thumbnails"][-1].get("url")
+    
+    return Track(url, title=title, thumbnail=thumbnail, duration=entry.get("duration"), video_id=video_id)
+
+
+class TrackQueue:
+    """Очередь треков: O(1) извлечение из головы, индексный доступ и страницы без копирования"""
+    
+    __slots__ = ("_items", "_head", "revision")
+    
+    # голову сжимаем, когда мёртвая часть списка заметно больше живой
+    _COMPACT_MIN = 1024
     
     def __init__(self):
-        super().__init__(timeout=None)
+        self._items: List[Optional[Track]] = []
+        self._head = 0
+        # растёт при каждом изменении — по нему видно, что снимок устарел
+        self.revision = 0
+    
+    def __len__(self) -> int:
+        return len(self._items) - self._head
+    
+    def __bool__(self) -> bool:
+        return len(self._items) > self._head
+    
+    def __iter__(self):
+        items = self._items
+        for i in range(self._head, len(items)):
+            yield items[i]
+    
+    def _pos(self, index: int) -> int:
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("Нет трека с таким номером")
+        return self._head + index
+    
+    def __getitem__(self, index: int) -> Track:
+        return self._items[self._pos(index)]
+    
+    def append(self, track: Track):
+        self._items.append(track)
+        self.revision += 1
+    
+    def push_front(self, track: Track):
+        """Вернуть трек в голову очереди"""
+        self.revision += 1
+        if self._head:
+            self._head -= 1
+            self._items[self._head] = track
+        else:
+            self._items.insert(0, track)
+    
+    def popleft(self) -> Track:
+        if not self:
+            raise IndexError("Очередь пуста")
+        track = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        self.revision += 1
+        if self._head >= self._COMPACT_MIN and self._head * 2 >= len(self._items):
+            del self._items[:self._head]
+            self._head = 0
+        return track
+    
+    def page(self, start: int, count: int) -> List[Track]:
+        """Срез очереди [start, start + count) — копируется только сама страница"""
+        start = max(0, start)
+        begin = self._head + start
+        return self._items[begin:begin + max(0, count)]
+    
+    def remove(self, index: int) -> Track:
+        pos = self._pos(index)
+        track = self._items[pos]
+        del self._items[pos]
+        self.revision += 1
+        return track
+    
+    def move(self, src: int, dst: int) -> Track:
+        """Переставить трек с позиции src на позицию dst"""
+        track = self.remove(src)
+        dst = max(0, min(dst, len(self)))
+        self._items.insert(self._head + dst, track)
+        return track
+    
+    def shuffle(self):
+        """Перемешать на месте (Фишер — Йейтс по живой части списка)"""
+        items, head = self._items, self._head
+        self.revision += 1
+        for i in range(len(items) - 1, head, -1):
+            j = random.randint(head, i)
+            items[i], items[j] = items[j], items[i]
+    
+    def dedupe(self) -> int:
+        """Убрать повторы (первое вхождение остаётся), вернуть число удалённых"""
+        items = self._items
+        seen: set = set()
+        write = self._head
+        for read in range(self._head, len(items)):
+            track = items[read]
+            key = track.video_id or track.lookup
+            if key in seen:
+                continue
+            seen.add(key)
+            items[write] = track
+            write += 1
+        removed = len(items) - write
+        del items[write:]
+        self.revision += 1
+        return removed
     
-    @staticmethod
-    def _get_player(interaction: Interaction) -> Optional[MusicPlayer]:
-        if not interaction.guild:
-            return None
-        return music_players.get(interaction.guild.id)
+    def clear(self):
+        self._items.clear()
+        self._head = 0
+        self.revision += 1
+
+
+async def _resolve_lookup(lookup: str) -> ResolvedTrack:
+    search_query = lookup if lookup.startswith(("http://", "https://")) else f"ytsearch1:{lookup}"
+    info = await run_extraction(_extract_info_sync, search_query, YTDLP_STREAM_OPTS)
     
-    @discord.ui.button(label="⏯ Вкл/Пауза", style=ButtonStyle.primary, custom_id="mp_toggle")
-    async def pause_resume(self, interaction: Interaction, _: Button):
-        player = self._get_player(interaction)
-        if not player or not player.vc or not player.vc.is_connected():
-            await interaction.response.send_message("❌ Бот не подключен", ephemeral=True)
+    # Если это поиск, берем первый результат
+    if "entries" in info:
+        entries = list(info["entries"])
+        if not entries:
+            raise LookupError("Ничего не найдено")
+        info = entries[0]
+    
+    resolved = _resolved_from_info(info)
+    if resolved is None:
+        raise LookupError("Не удалось получить поток для FFmpeg")
+    
+    track_cache.put(lookup, resolved)
+    return resolved
+
+
+async def resolve_track(track: Track) -> ResolvedTrack:
+    """Получить живую ссылку на поток: из трека, из кэша или новым извлечением"""
+    if not track.needs_resolve:
+        return track.resolved
+    
+    lookup = track.lookup
+    resolved = track_cache.get(lookup)
+    if resolved is None:
+        # одинаковые запросы от разных серверов ждут одно извлечение
+        task = _inflight_resolves.get(lookup)
+        if task is None:
+            task = asyncio.create_task(_resolve_lookup(lookup))
+            _inflight_resolves[lookup] = task
+            task.add_done_callback(lambda _: _inflight_resolves.pop(lookup, None))
+        resolved = await asyncio.shield(task)
+    
+    track.apply(resolved)
+    title_index.add(resolved.title, resolved.webpage_url, resolved.duration)
+    return resolved
+
+
+
+# ============================================================================
+# ПОДСКАЗКИ ДЛЯ /play
+# ============================================================================
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _index_words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Префиксный и триграммный индекс названий недавно найденных треков"""
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # ссылка -> (название, длительность, нормализованное название)
+        self._entries: "OrderedDict[str, Tuple[str, Optional[float], str]]" = OrderedDict()
+        self._grams: Dict[str, set] = {}
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def add(self, title: str, url: str, duration: Optional[float] = None):
+        if not title or not url or len(url) > 100:
+            return
+        if url in self._entries:
+            self._entries.move_to_end(url)
             return
         
-        await interaction.response.defer(ephemeral=True)
+        norm = " ".join(_index_words(title))
+        self._entries[url] = (title, duration, norm)
+        for gram in _trigrams(norm):
+            self._grams.setdefault(gram, set()).add(url)
         
-        if player.vc.is_paused():
-            player.resume()
-        elif player.vc.is_playing():
-            player.pause()
+        while len(self._entries) > self.maxsize:
+            self._drop(*self._entries.popitem(last=False))
+    
+    def _drop(self, url: str, entry: Tuple[str, Optional[float], str]):
+        for gram in _trigrams(entry[2]):
+            urls = self._grams.get(gram)
+            if urls is not None:
+                urls.discard(url)
+                if not urls:
+                    del self._grams[gram]
+    
+    def search(self, query: str, limit: int = 25) -> List[Tuple[str, str, Optional[float]]]:
+        """Лучшие совпадения: (название, ссылка, длительность)"""
+        words = _index_words(query)
+        if not words:
+            # пустой ввод — просто последние треки
+            recent = list(self._entries.items())[-limit:]
+            return [(title, url, duration) for url, (title, duration, _) in reversed(recent)]
         
-        await player.update_control_message()
+        norm = " ".join(words)
+        grams = _trigrams(norm)
+        counts: Dict[str, int] = {}
+        for gram in grams:
+            for url in self._grams.get(gram, ()):
+                counts[url] = counts.get(url, 0) + 1
+        
+        scored = []
+        for url, shared in counts.items():
+            title, duration, title_norm = self._entries[url]
+            score = shared / len(grams)
+            # каждое слово запроса — начало слова в названии
+            title_words = title_norm.split()
+            if all(any(tw.startswith(w) for tw in title_words) for w in words):
+                score += 1.0
+            if title_norm.startswith(norm):
+                score += 0.5
+            if score >= 0.5:
+                scored.append((score, title, url, duration))
+        
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [(title, url, duration) for _, title, url, duration in scored[:limit]]
+
+
+title_index = TitleIndex(AUTOCOMPLETE_INDEX_SIZE)
+_remote_suggestions: "OrderedDict[str, List[Tuple[str, str, Optional[float]]]]" = OrderedDict()
+_autocomplete_pending: Dict[int, int] = {}
+_suggest_executor = ThreadPoolExecutor(max_workers=AUTOCOMPLETE_SEARCH_WORKERS, thread_name_prefix="suggest")
+_inflight_searches: Dict[str, asyncio.Future] = {}
+
+
+def _store_suggestions(key: str, fut: asyncio.Future):
+    """Сохранить результат поиска, даже если ответ пользователю уже не нужен"""
+    _inflight_searches.pop(key, None)
+    if fut.cancelled() or fut.exception() is not None:
+        return
     
-    @discord.ui.button(label="⏭ Пропустить", style=ButtonStyle.secondary, custom_id="mp_skip")
-    async def skip(self, interaction: Interaction, _: Button):
+    results = []
+    for entry in fut.result().get("entries") or []:
+        track = _track_from_entry(entry)
+        if track is None:
+            continue
+        title_index.add(track.title, track.lookup, track.duration)
+        results.append((track.title, track.lookup, track.duration))
+    
+    _remote_suggestions[key] = results
+    while len(_remote_suggestions) > 256:
+        _remote_suggestions.popitem(last=False)
+
+
+async def _remote_search(query: str) -> List[Tuple[str, str, Optional[float]]]:
+    """Поиск на YouTube для подсказок (плоский, без извлечения потоков)"""
+    key = _normalize_query(query)
+    if key in _remote_suggestions:
+        _remote_suggestions.move_to_end(key)
+        return _remote_suggestions[key]
+    
+    # тот же запрос уже ищется — ждём его, а не запускаем второй
+    fut = _inflight_searches.get(key)
+    if fut is None:
+        if len(_inflight_searches) >= AUTOCOMPLETE_SEARCH_WORKERS:
+            # пул подсказок занят — не копим очередь за медленным YouTube
+            raise ExtractorBusy()
+        fut = asyncio.get_running_loop().run_in_executor(
+            _suggest_executor,
+            _extract_info_sync,
+            f"ytsearch{AUTOCOMPLETE_REMOTE_RESULTS}:{query}",
+            YTDLP_PLAYLIST_OPTS,
+        )
+        _inflight_searches[key] = fut
+        fut.add_done_callback(lambda f: _store_suggestions(key, f))
+    
+    # таймаут не отменяет поиск: результат попадёт в кэш к следующему нажатию
+    await asyncio.wait_for(asyncio.shield(fut), AUTOCOMPLETE_REMOTE_TIMEOUT)
+    return _remote_suggestions.get(key, [])
+
+
+async def suggest_tracks(user_id: int, query: str, limit: int = 25) -> List[Tuple[str, str, Optional[float]]]:
+    """Подсказки: сначала локальный индекс, удалённый поиск — только когда ввод затих"""
+    local = title_index.search(query, limit)
+    query = query.strip()
+    if local or len(query) < 3 or query.startswith(("http://", "https://")):
+        return local
+    
+    # каждое нажатие клавиши — новый запрос; ищем только последний
+    stamp = _autocomplete_pending.get(user_id, 0) + 1
+    _autocomplete_pending[user_id] = stamp
+    await asyncio.sleep(AUTOCOMPLETE_DEBOUNCE)
+    if _autocomplete_pending.get(user_id) != stamp:
+        return []
+    
+    try:
+        return (await _remote_search(query))[:limit]
+    except (asyncio.TimeoutError, ExtractorBusy):
+        return []
+    except Exception as e:
+        logging.warning(f"Поиск подсказок '{query}' не удался: {e}")
+        return []
+    finally:
+        if _autocomplete_pending.get(user_id) == stamp:
+            del _autocomplete_pending[user_id]
+
+
+# ============================================================================
+# ЛОКАЛЬНЫЙ КЭШ АУДИО
+# ============================================================================
+
+class AudioDiskCache:
+    """Opus-файлы часто играемых треков на диске (LRU с ограничением по размеру)"""
+    
+    SUFFIX = ".opus"
+    
+    def __init__(self, directory: str, max_bytes: int, min_plays: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.total_bytes = 0
+        self.hits = 0
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._plays: "OrderedDict[str, int]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._workers = asyncio.Semaphore(AUDIO_CACHE_WORKERS)
+        self.active_pids: set = set()
+        self._load_index()
+    
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part"):
+                # недописанный файл от прошлого запуска
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((st.st_mtime, name[:-len(self.SUFFIX)], st.st_size))
+        
+        for _, key, size in sorted(found):
+            self._files[key] = size
+            self.total_bytes += size
+        self._evict()
+    
+    @staticmethod
+    def key_for(track: Track) -> str:
+        if track.video_id and re.fullmatch(r"[\w-]{1,64}", track.video_id):
+            return track.video_id
+        return hashlib.sha1(track.lookup.encode("utf-8")).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+    
+    def path_for(self, track: Track) -> Optional[str]:
+        """Путь к локальной копии, если она есть"""
+        key = self.key_for(track)
+        if key not in self._files:
+            return None
+        path = self._path(key)
+        try:
+            # mtime служит порядком LRU после перезапуска
+            os.utime(path)
+        except OSError:
+            self._forget(key)
+            return None
+        self._files.move_to_end(key)
+        self.hits += 1
+        return path
+    
+    def note_play(self, track: Track):
+        """Учесть проигрывание; популярный трек ставится в очередь на сохранение"""
+        key = self.key_for(track)
+        plays = self._plays.pop(key, 0) + 1
+        self._plays[key] = plays
+        while len(self._plays) > 10000:
+            self._plays.popitem(last=False)
+        
+        if plays < self.min_plays or key in self._files or key in self._inflight:
+            return
+        if track.resolved is None or track.needs_resolve:
+            return
+        if not track.duration or track.duration > AUDIO_CACHE_MAX_DURATION:
+            return
+        
+        task = asyncio.create_task(self._store(key, track.resolved))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+    
+    async def _store(self, key: str, resolved: ResolvedTrack):
+        final = self._path(key)
+        tmp = final + ".part"
+        codec = ["-c:a", "copy"] if resolved.acodec == "opus" else ["-c:a", "libopus", "-b:a", "128k"]
+        async with self._workers:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    FFMPEG_EXECUTABLE, "-nostdin", "-loglevel", "error", "-y",
+                    *FFMPEG_OPTIONS["before_options"].split(),
+                    "-i", resolved.stream_url, "-vn", *codec, "-f", "ogg", tmp,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                self.active_pids.add(proc.pid)
+                try:
+                    _, err = await proc.communicate()
+                except asyncio.CancelledError:
+                    proc.kill()
+                    raise
+                finally:
+                    self.active_pids.discard(proc.pid)
+                if proc.returncode != 0:
+                    raise RuntimeError(err.decode(errors="ignore").strip()[:200] or f"код {proc.returncode}")
+                # файл появляется под своим именем только целиком
+                os.replace(tmp, final)
+                size = os.path.getsize(final)
+            except asyncio.CancelledError:
+                self._remove_file(tmp)
+                raise
+            except Exception as e:
+                logging.warning(f"Не удалось сохранить трек {key} в кэш: {e}")
+                self._remove_file(tmp)
+                return
+        
+        self._forget(key)
+        self._files[key] = size
+        self.total_bytes += size
+        self._evict()
+    
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self.total_bytes -= size
+            self._remove_file(self._path(key))
+    
+    def _forget(self, key: str):
+        size = self._files.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+    
+    def discard(self, track: Track):
+        """Удалить локальную копию трека"""
+        key = self.key_for(track)
+        if key in self._files:
+            self._forget(key)
+            self._remove_file(self._path(key))
+    
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def __len__(self) -> int:
+        return len(self._files)
+
+
+audio_cache: Optional[AudioDiskCache] = (
+    AudioDiskCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_MIN_PLAYS) if AUDIO_CACHE_DIR else None
+)
+
+
+# ============================================================================
+# ОТКАЗЫ ИСТОЧНИКОВ
+# ============================================================================
+
+class SourceUnavailable(Exception):
+    """Хост источника временно исключён размыкателем"""
+    
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(host)
+        self.host = host
+        self.retry_in = retry_in
+
+
+class HostCircuitBreaker:
+    """Размыкатель по хостам: хост на время исключается, когда большая доля обращений к нему падает"""
+    
+    def __init__(self, min_failures: int, failure_rate: float, window: float, cooldown: float):
+        self.min_failures = min_failures
+        self.failure_rate = failure_rate
+        self.window = window
+        self.cooldown = cooldown
+        # хост -> (время, успех) за последнее окно и число отказов среди них
+        self._events: Dict[str, deque] = {}
+        self._failed: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+    
+    def retry_in(self, host: str) -> float:
+        """Сколько секунд хост ещё закрыт (0 — можно обращаться)"""
+        until = self._open_until.get(host)
+        if until is None:
+            return 0.0
+        left = until - time.monotonic()
+        if left <= 0:
+            del self._open_until[host]
+            return 0.0
+        return left
+    
+    def _record(self, host: str, ok: bool) -> int:
+        now = time.monotonic()
+        events = self._events.setdefault(host, deque())
+        failed = self._failed.get(host, 0)
+        while events and now - events[0][0] > self.window:
+            if not events.popleft()[1]:
+                failed -= 1
+        events.append((now, ok))
+        if not ok:
+            failed += 1
+        self._failed[host] = failed
+        return failed
+    
+    def record_failure(self, host: str):
+        failed = self._record(host, False)
+        total = len(self._events[host])
+        if failed >= self.min_failures and failed / total >= self.failure_rate:
+            self._open_until[host] = time.monotonic() + self.cooldown
+            self._events.pop(host, None)
+            self._failed.pop(host, None)
+            logging.warning(f"Источник {host} отключён на {self.cooldown} с: {failed} из {total} обращений с ошибкой")
+    
+    def record_success(self, host: str):
+        self._record(host, True)
+    
+    def open_hosts(self) -> List[str]:
+        return [h for h in list(self._open_until) if self.retry_in(h) > 0]
+
+
+source_breaker = HostCircuitBreaker(BREAKER_MIN_FAILURES, BREAKER_FAILURE_RATE, BREAKER_WINDOW, BREAKER_COOLDOWN)
+dead_tracks: "OrderedDict[str, str]" = OrderedDict()
+
+# ответы yt_dlp про сам ролик — повторять бесполезно, и хост тут ни при чём
+_UNAVAILABLE_MARKERS = (
+    "video unavailable", "this video is not available", "private video", "has been removed",
+    "has been terminated", "not available in your country", "not made this video available",
+    "copyright", "members-only", "confirm your age", "does not exist", "http error 404", "http error 410",
+)
+# признаки отказа самого хоста: сеть, 5xx, ограничение частоты
+_HOST_FAILURE_MARKERS = (
+    "http error 5", "http error 429", "timed out", "connection", "temporary failure", "unable to download webpage",
+)
+
+
+def _error_text(error: BaseException) -> str:
+    exc_info = getattr(error, "exc_info", None)
+    cause = exc_info[1] if exc_info and exc_info[1] is not None else None
+    return f"{error} {cause or ''}".lower()
+
+
+def is_unavailable_error(error: BaseException) -> bool:
+    """Ролик удалён, закрыт или недоступен в регионе"""
+    if isinstance(error, yt_dlp.utils.GeoRestrictedError):
+        return True
+    if not isinstance(error, (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError)):
+        return False
+    text = _error_text(error)
+    return any(marker in text for marker in _UNAVAILABLE_MARKERS)
+
+
+def is_host_failure(error: BaseException) -> bool:
+    """Ошибка говорит о проблемах хоста, а не конкретного трека"""
+    if isinstance(error, (OSError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError)):
+        text = _error_text(error)
+        return any(marker in text for marker in _HOST_FAILURE_MARKERS)
+    return False
+
+
+# короткие и зеркальные домены — тот же источник
+_HOST_ALIASES = {"youtu.be": "youtube.com"}
+
+
+def _host_of(url: str) -> str:
+    if not url.startswith(("http://", "https://")):
+        # поисковые запросы уходят в YouTube
+        return "youtube.com"
+    netloc = urlparse(url).hostname or ""
+    host = ".".join(netloc.split(".")[-2:]) or netloc
+    return _HOST_ALIASES.get(host, host)
+
+
+def _track_host(track: Track) -> str:
+    """Источник трека для размыкателя"""
+    # по странице, а не по CDN потока: отказы до и после резолва копятся на одном ключе
+    return _host_of(track.lookup)
+
+
+def mark_track_dead(track: Track, reason: str):
+    """Запомнить неиграбельный трек и выбросить его из кэшей"""
+    dead_tracks[track.key] = reason
+    dead_tracks.move_to_end(track.key)
+    while len(dead_tracks) > DEAD_TRACKS_LIMIT:
+        dead_tracks.popitem(last=False)
+    
+    if track.video_id:
+        track_cache.invalidate(track.video_id)
+    if audio_cache:
+        audio_cache.discard(track)
+    track.resolved = None
+
+
+# ============================================================================
+# ОБРАБОТКА ЗВУКА (DSP)
+# ============================================================================
+
+def _dsp_effects_enabled() -> bool:
+    return np is not None and (MUSIC_CROSSFADE_SECONDS > 0 or MUSIC_NORMALIZE)
+
+
+class DSPAudioSource(discord.AudioSource):
+    """PCM-стадия на NumPy: громкость, нормализация, мягкий клиппинг и кроссфейд"""
+    
+    FRAMES_PER_SECOND = 50
+    
+    def __init__(self, original: discord.AudioSource, volume: float = 1.0, normalize: bool = False):
+        if original.is_opus():
+            raise discord.ClientException("AudioSource must not be Opus encoded.")
+        
+        self.original = original
+        self.volume = volume
+        self.normalize = normalize
+        self.frames = 0
+        
+        # все буферы выделяются один раз, обработка кадра идёт на месте
+        samples = discord.opus.Encoder.FRAME_SIZE // 2
+        self._buf = np.zeros(samples, dtype=np.float32)
+        self._aux = np.zeros(samples, dtype=np.float32)
+        self._tmp = np.zeros(samples, dtype=np.float32)
+        self._out = np.zeros(samples, dtype=np.int16)
+        
+        self._rms = DSP_TARGET_RMS
+        self._norm_gain = 1.0
+        
+        self._incoming: Optional[discord.AudioSource] = None
+        self._on_switch = None
+        self._fade_start = 0
+        self._fade_total = 0
+        self._fade_pos = 0
+        # crossfade_to зовётся из цикла событий, read — из аудиопотока
+        self._lock = threading.Lock()
+    
+    def is_opus(self) -> bool:
+        return False
+    
+    def crossfade_to(self, incoming: discord.AudioSource, start_frame: int, fade_frames: int, on_switch=None):
+        """С кадра start_frame плавно перейти на incoming; on_switch(bool) — из аудиопотока"""
+        if incoming.is_opus():
+            raise discord.ClientException("AudioSource must not be Opus encoded.")
+        with self._lock:
+            self._drop_incoming()
+            self._incoming = incoming
+            self._on_switch = on_switch
+            self._fade_start = start_frame
+            self._fade_total = max(1, fade_frames)
+            self._fade_pos = 0
+    
+    def read(self) -> bytes:
+        with self._lock:
+            buf = self._buf
+            if not self._load(self.original, buf):
+                if self._incoming is None:
+                    return b""
+                # текущий трек кончился раньше расчётного — сразу переключаемся
+                self._switch()
+                if not self._load(self.original, buf):
+                    return b""
+            
+            self.frames += 1
+            if self._incoming is not None and self.frames > self._fade_start:
+                self._mix_incoming(buf)
+            
+            self._process(buf)
+            return self._out.tobytes()
+    
+    def cleanup(self):
+        with self._lock:
+            self.original.cleanup()
+            self._drop_incoming()
+    
+    @staticmethod
+    def _load(source: discord.AudioSource, target) -> bool:
+        data = source.read()
+        if not data:
+            return False
+        pcm = np.frombuffer(data, dtype=np.int16)
+        n = min(pcm.size, target.size)
+        np.multiply(pcm[:n], 1.0 / 32768.0, out=target[:n], casting="unsafe")
+        if n < target.size:
+            target[n:] = 0.0
+        return True
+    
+    def _mix_incoming(self, buf):
+        aux = self._aux
+        if not self._load(self._incoming, aux):
+            # следующий трек не отдал звук — остаёмся на текущем
+            self._drop_incoming()
+            return
+        
+        self._fade_pos += 1
+        t = min(1.0, self._fade_pos / self._fade_total)
+        # равномощный переход: сумма квадратов коэффициентов постоянна
+        buf *= math.cos(t * math.pi / 2)
+        aux *= math.sin(t * math.pi / 2)
+        buf += aux
+        
+        if self._fade_pos >= self._fade_total:
+            self._switch()
+    
+    def _switch(self):
+        self.original.cleanup()
+        self.original = self._incoming
+        self.frames = self._fade_pos
+        self._incoming = None
+        self._fade_pos = 0
+        callback, self._on_switch = self._on_switch, None
+        if callback:
+            callback(True)
+    
+    def _drop_incoming(self):
+        if self._incoming is None:
+            return
+        self._incoming.cleanup()
+        self._incoming = None
+        callback, self._on_switch = self._on_switch, None
+        if callback:
+            callback(False)
+    
+    def _process(self, buf):
+        gain = self.volume
+        if self.normalize:
+            level = math.sqrt(float(np.dot(buf, buf)) / buf.size)
+            if level > 1e-4:
+                self._rms += (level - self._rms) * 0.02
+                target = min(4.0, max(0.25, DSP_TARGET_RMS / self._rms))
+                self._norm_gain += (target - self._norm_gain) * 0.05
+            gain *= self._norm_gain
+        
+        if gain != 1.0:
+            buf *= gain
+        
+        peak = max(float(buf.max()), -float(buf.min()))
+        if peak > DSP_SOFT_CLIP_KNEE:
+            self._soft_clip(buf)
+        
+        buf *= 32767.0
+        np.copyto(self._out, buf, casting="unsafe")
+    
+    def _soft_clip(self, buf):
+        """Ниже колена сигнал не трогаем, выше — сжимаем через tanh"""
+        knee = DSP_SOFT_CLIP_KNEE
+        room = 1.0 - knee
+        over, tmp = self._aux, self._tmp
+        np.abs(buf, out=over)
+        over -= knee
+        np.maximum(over, 0.0, out=over)
+        over /= room
+        # на сколько уменьшить модуль: room * (u - tanh(u))
+        np.tanh(over, out=tmp)
+        over -= tmp
+        over *= room
+        np.copysign(over, buf, out=over)
+        buf -= over
+
+
+# ============================================================================
+# МУЗЫКАЛЬНЫЙ ПЛЕЕР
+# ============================================================================
+
+class FrameCounter(discord.AudioSource):
+    """Обёртка источника, которая считает отданные в войс кадры"""
+    
+    def __init__(self, original: discord.AudioSource):
+        self.original = original
+        self.frames = 0
+    
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+    
+    def read(self) -> bytes:
+        data = self.original.read()
+        if data:
+            self.frames += 1
+        return data
+    
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class ApiCallTracker:
+    """Счётчик вызовов Discord API по серверам за скользящую минуту"""
+    
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._calls: Dict[int, deque] = {}
+    
+    def _prune(self, guild_id: int, now: float) -> Optional[deque]:
+        calls = self._calls.get(guild_id)
+        if calls is None:
+            return None
+        while calls and now - calls[0] > self.window:
+            calls.popleft()
+        if not calls:
+            del self._calls[guild_id]
+            return None
+        return calls
+    
+    def record(self, guild_id: int):
+        now = time.monotonic()
+        self._prune(guild_id, now)
+        self._calls.setdefault(guild_id, deque()).append(now)
+    
+    def per_minute(self, guild_id: int) -> int:
+        calls = self._prune(guild_id, time.monotonic())
+        return len(calls) if calls else 0
+
+
+panel_api_calls = ApiCallTracker()
+_music_control_view: Optional["MusicControlView"] = None
+
+
+def get_music_control_view() -> "MusicControlView":
+    """Один постоянный экземпляр панели на весь бот"""
+    global _music_control_view
+    if _music_control_view is None:
+        _music_control_view = MusicControlView()
+    return _music_control_view
+
+
+class PlayerClosed(Exception):
+    """Плеер остановлен, его воркер больше не принимает команды"""
+
+
+class MusicPlayer:
+    """Музыкальный плеер для сервера"""
+    
+    def __init__(self, guild: discord.Guild, vc: discord.VoiceClient,
+                 text_channel: discord.abc.Messageable):
+        self.guild = guild
+        self.vc = vc
+        self.text_channel = text_channel
+        self.volume = MUSIC_DEFAULT_VOLUME
+        self.current_source: Optional[discord.AudioSource] = None
+        self.queue = TrackQueue()
+        self.current_track: Optional[Track] = None
+        self.control_message: Optional[discord.Message] = None
+        self._commands: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+        self.commands_handled = 0
+        self.command_latency_total = 0.0
+        self.command_latency_max = 0.0
+        self._worker_task = asyncio.create_task(self._worker())
+        self._prefetch_tasks: set = set()
+        self._ingest_task: Optional[asyncio.Task] = None
+        self._panel_task: Optional[asyncio.Task] = None
+        self._panel_lock = asyncio.Lock()
+        self._panel_rendered: Optional[dict] = None
+        # после остановки панель не обновляется, пока плеер снова не заиграет
+        self._panel_closed = False
+        self.panel_skipped = 0
+        self._warm: Optional[Tuple[Track, discord.AudioSource, float]] = None
+        self._warm_task: Optional[asyncio.Task] = None
+        self._fading_track: Optional[Track] = None
+        self._last_track_end: Optional[float] = None
+        self._track_started_at = 0.0
+        self._stop_requested = False
+        self._breaker_retry: Optional[asyncio.TimerHandle] = None
+        # позиция = смещение, с которого открыт источник, + отданные кадры
+        self._frame_source: Optional[discord.AudioSource] = None
+        self._position_base = 0.0
+        self.idle_since: Optional[float] = None
+        self.alone_since: Optional[float] = None
+        self.paused_since: Optional[float] = None
+        self.last_gap: Optional[float] = None
+        self.gap_total = 0.0
+        self.gap_count = 0
+
+    async def add_track(self, query: str) -> Tuple[bool, str]:
+        """Добавить трек в очередь с корректным потоком для FFmpeg"""
+        track, message = await self._load_track(query)
+        if track is None:
+            return False, message
+        self.queue.append(track)
+        return True, message
+    
+    async def add_tracks(self, queries: List[str]) -> List[Tuple[bool, str]]:
+        """Найти несколько треков параллельно и добавить их в порядке запросов"""
+        slots = asyncio.Semaphore(BATCH_RESOLVE_CONCURRENCY)
+        
+        async def load(query: str):
+            async with slots:
+                return await self._load_track(query)
+        
+        loaded = await asyncio.gather(*(load(q) for q in queries))
+        results = []
+        for track, message in loaded:
+            if track is not None:
+                self.queue.append(track)
+            results.append((track is not None, message))
+        return results
+    
+    @staticmethod
+    async def _load_track(query: str) -> Tuple[Optional[Track], str]:
+        """Найти трек по запросу; при ошибке — None и текст для пользователя"""
+        try:
+            track = Track(query)
+            await resolve_track(track)
+            return track, f"➕ **{track.title}** добавлен в очередь"
+        
+        except ExtractorBusy:
+            return None, "⏳ Сейчас слишком много запросов, попробуйте через пару секунд"
+        except asyncio.TimeoutError:
+            logging.warning(f"Таймаут извлечения: {query}")
+            return None, "⌛ Поиск трека занял слишком много времени"
+        except LookupError as e:
+            return None, f"❌ {e}"
+        except Exception as e:
+            if is_unavailable_error(e):
+                return None, "❌ Видео удалено или недоступно"
+            logging.error(f"Ошибка добавления трека: {e}")
+            return None, f"❌ Ошибка: {str(e)}"
+
+    async def add_playlist(self, url: str) -> Tuple[bool, str]:
+        """Начать добавление плейлиста; возвращается, как только готов первый трек"""
+        if self._ingest_task and not self._ingest_task.done():
+            return False, "⏳ Предыдущий плейлист ещё добавляется"
+        
+        entries = iter_playlist(url)
+        try:
+            first = None
+            while first is None:
+                first = _track_from_entry(await entries.__anext__())
+        except StopAsyncIteration:
+            return False, "❌ В плейлисте нет доступных треков"
+        except ExtractorBusy:
+            return False, "⏳ Сейчас слишком много запросов, попробуйте через пару секунд"
+        except asyncio.TimeoutError:
+            await entries.aclose()
+            return False, "⌛ Загрузка плейлиста заняла слишком много времени"
+        except Exception as e:
+            await entries.aclose()
+            logging.error(f"Ошибка загрузки плейлиста: {e}")
+            return False, f"❌ Ошибка: {str(e)}"
+        
+        self.queue.append(first)
+        self._ingest_task = asyncio.create_task(self._ingest_playlist(entries))
+        return True, f"📃 Плейлист: **{first.title}** добавлен, остальные треки подгружаются"
+    
+    async def _ingest_playlist(self, entries):
+        """Дописывать в очередь оставшиеся треки плейлиста"""
+        added = 1
+        try:
+            async for entry in entries:
+                track = _track_from_entry(entry)
+                if track is None or track.key in dead_tracks:
+                    continue
+                self.queue.append(track)
+                added += 1
+                if len(self.queue) <= PREFETCH_AHEAD:
+                    self.prefetch_upcoming()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Плейлист загружен не полностью: {e}")
+        finally:
+            await entries.aclose()
+        
+        await self.update_control_message()
+        try:
+            await self.text_channel.send(f"📃 Из плейлиста добавлено треков: **{added}**")
+        except Exception:
+            pass
+    
+    # --- воркер: все переходы сервера идут через одну очередь команд ---
+    
+    def submit(self, name: str, payload=None):
+        """Поставить команду воркеру, не дожидаясь выполнения"""
+        if self._closed:
+            return
+        self._commands.put_nowait((name, payload, time.monotonic(), None))
+    
+    async def command(self, name: str, payload=None):
+        """Выполнить команду через воркер и вернуть её результат"""
+        if self._closed:
+            raise PlayerClosed()
+        fut = asyncio.get_running_loop().create_future()
+        self._commands.put_nowait((name, payload, time.monotonic(), fut))
+        return await fut
+    
+    @property
+    def queue_depth(self) -> int:
+        return self._commands.qsize()
+    
+    @property
+    def avg_command_latency(self) -> Optional[float]:
+        return self.command_latency_total / self.commands_handled if self.commands_handled else None
+    
+    async def _worker(self):
+        while True:
+            name, payload, enqueued_at, fut = await self._commands.get()
+            try:
+                result = await self._dispatch(name, payload)
+            except asyncio.CancelledError:
+                if fut and not fut.done():
+                    fut.set_exception(PlayerClosed())
+                raise
+            except Exception as e:
+                logging.error(f"Команда {name} плеера {self.guild.id} завершилась ошибкой: {e}")
+                if fut and not fut.done():
+                    fut.set_exception(e)
+            else:
+                if fut and not fut.done():
+                    fut.set_result(result)
+            
+            latency = time.monotonic() - enqueued_at
+            self.commands_handled += 1
+            self.command_latency_total += latency
+            self.command_latency_max = max(self.command_latency_max, latency)
+    
+    async def _dispatch(self, name: str, payload):
+        if name == "play":
+            await self._advance()
+        elif name == "track_end":
+            await self._advance(ended=payload)
+        elif name == "skip":
+            self.stop()
+        elif name == "volume":
+            return await self._change_volume(payload)
+        elif name == "seek":
+            return await self._seek(payload)
+        elif name == "stop":
+            self.stop()
+            await self.stop_and_cleanup()
+        elif name == "crossfade":
+            self._on_crossfade_done(*payload)
+        else:
+            raise ValueError(f"Неизвестная команда плеера: {name}")
+    
+    async def play_next(self):
+        """Воспроизвести следующий трек (через воркер)"""
+        try:
+            await self.command("play")
+        except PlayerClosed:
+            # плеер остановили, пока добавлялись треки — играть нечему
+            pass
+    
+    async def close(self):
+        """Остановить плеер и его воркер"""
+        if self._closed:
+            return
+        stop = asyncio.get_running_loop().create_future()
+        self._commands.put_nowait(("stop", None, time.monotonic(), stop))
+        # всё, что придёт после stop, уже не выполнится
+        self._closed = True
+        try:
+            await asyncio.wait_for(stop, timeout=10)
+        except Exception as e:
+            logging.error(f"Плеер {self.guild.id} не остановился штатно: {e}")
+            await self.stop_and_cleanup()
+        finally:
+            self._worker_task.cancel()
+            self._fail_pending()
+    
+    def _fail_pending(self):
+        """Ответить всем, кто ждёт команды, которую воркер уже не выполнит"""
+        while not self._commands.empty():
+            fut = self._commands.get_nowait()[3]
+            if fut and not fut.done():
+                fut.set_exception(PlayerClosed())
+    
+    async def _advance(self, ended: Optional[Tuple[Optional[Exception], float]] = None):
+        """Запустить следующий трек; битые треки пропускаются в цикле"""
+        if ended is not None:
+            # трек закончился до переключения — его кроссфейд уже не состоится
+            self._fading_track = None
+            self._settle_finished(*ended)
+        
+        while self.queue:
+            if not self.vc.is_connected() or self.vc.is_playing() or self.vc.is_paused():
+                # войс отключён — очередь продолжится после переподключения;
+                # уже играет — очередь продолжит after текущего трека
+                return
+            track = self.queue.popleft()
+            if track.key in dead_tracks:
+                continue
+            
+            try:
+                source = await self._open_with_retries(track)
+            except SourceUnavailable as e:
+                # хост отключён — ждём, не перебирая всю очередь впустую
+                self.queue.push_front(track)
+                await self._wait_for_source(e)
+                return
+            if source is None:
+                continue
+            
+            offset = track.start_at
+            source = self._bind_source(source, offset)
+
+            def after_playing(error):
+                if error:
+                    logging.error(f"Ошибка воспроизведения: {error}")
+                
+                self._last_track_end = time.perf_counter()
+                elapsed = time.monotonic() - self._track_started_at
+                # из аудиопотока — только один дешёвый вызов в цикл событий
+                bot.loop.call_soon_threadsafe(self.submit, "track_end", (error, elapsed))
+            
+            try:
+                self.vc.play(source, after=after_playing)
+            except discord.ClientException as e:
+                logging.error(f"Ошибка vc.play: {e}")
+                source.cleanup()
+                self.current_source = None
+                # уже что-то играет — очередь продолжит его after;
+                # войс отвалился — продолжим после переподключения
+                self.queue.push_front(track)
+                return
+            
+            self.current_track = track
+            self._track_started_at = time.monotonic()
+            track.start_at = 0.0
+            self._record_gap()
+            if audio_cache and not offset:
+                audio_cache.note_play(track)
+            self.prefetch_upcoming()
+            self._schedule_prewarm(track, elapsed=offset)
+            self._panel_closed = False
+            await self.update_control_message()
+            return
+        
+        await self.stop_and_cleanup()
+    
+    async def _open_with_retries(self, track: Track) -> Optional[discord.AudioSource]:
+        """Открыть трек с ограниченным числом попыток; None — трек неиграбелен"""
+        reason = "неизвестная ошибка"
+        while track.failures < TRACK_MAX_ATTEMPTS:
+            host = _track_host(track)
+            retry_in = source_breaker.retry_in(host)
+            if retry_in:
+                raise SourceUnavailable(host, retry_in)
+            
+            try:
+                source = self._take_warm(track)
+                if source is None:
+                    source = await self._open_track(track, track.start_at)
+                source_breaker.record_success(host)
+                return source
+            except LookupError as e:
+                # видео удалено/недоступно — повторять бессмысленно
+                reason = str(e)
+                break
+            except ExtractorBusy:
+                raise SourceUnavailable(host, YTDLP_QUEUE_WAIT) from None
+            except Exception as e:
+                reason = str(e) or type(e).__name__
+                if is_unavailable_error(e):
+                    break
+                track.failures += 1
+                track.resolved = None
+                if is_host_failure(e):
+                    source_breaker.record_failure(host)
+                logging.warning(f"Попытка {track.failures}/{TRACK_MAX_ATTEMPTS} для {track.title} не удалась: {reason}")
+                if track.failures < TRACK_MAX_ATTEMPTS:
+                    await asyncio.sleep(TRACK_RETRY_BACKOFF * track.failures)
+        
+        await self._drop_dead(track, reason)
+        return None
+    
+    def _settle_finished(self, error: Optional[Exception], elapsed: float):
+        """Разобрать, чем закончился прошлый трек: норма, пропуск или обрыв"""
+        track = self.current_track
+        stopped, self._stop_requested = self._stop_requested, False
+        if track is None or stopped:
+            return
+        
+        position = self.position
+        if self.vc and not self.vc.is_connected() and self._interrupted_at(track, position):
+            # войс отключился посреди трека — это не вина источника
+            track.start_at = position
+            self.queue.push_front(track)
+            return
+        
+        host = _track_host(track)
+        early = elapsed < TRACK_EARLY_EXIT and (track.duration or 0) > TRACK_EARLY_EXIT
+        if error is None and not early:
+            source_breaker.record_success(host)
+            track.failures = 0
+            return
+        
+        # FFmpeg умер сразу после старта — почти всегда протухшая ссылка или отказ CDN
+        source_breaker.record_failure(host)
+        if audio_cache:
+            audio_cache.discard(track)
+        track.failures += 1
+        track.resolved = None
+        if track.failures < TRACK_MAX_ATTEMPTS:
+            if not early and self._interrupted_at(track, position):
+                # поток оборвался посреди трека — продолжаем с того же места
+                track.start_at = position
+            self.queue.push_front(track)
+        else:
+            reason = str(error) if error else "поток обрывается сразу после старта"
+            mark_track_dead(track, reason)
+            logging.warning(f"Трек {track.title} исключён: {reason}")
+    
+    async def _drop_dead(self, track: Track, reason: str):
+        mark_track_dead(track, reason)
+        logging.warning(f"Трек {track.title} исключён: {reason}")
+        try:
+            await self.text_channel.send(f"⚠️ Пропущен **{track.title}**: {reason[:200]}")
+        except Exception:
+            pass
+    
+    async def _wait_for_source(self, error: SourceUnavailable):
+        """Отложить воспроизведение, пока размыкатель не пустит к хосту"""
+        if self._breaker_retry:
+            self._breaker_retry.cancel()
+        loop = asyncio.get_running_loop()
+        self._breaker_retry = loop.call_later(
+            error.retry_in, self.submit, "play"
+        )
+        try:
+            await self.text_channel.send(
+                f"⚠️ Источник {error.host} временно недоступен, продолжу через {int(error.retry_in) + 1} с"
+            )
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _is_passthrough(volume: float) -> bool:
+        return abs(volume - 1.0) < 1e-6
+    
+    @classmethod
+    def _wants_pcm(cls, volume: float) -> bool:
+        return _dsp_effects_enabled() or not cls._is_passthrough(volume)
+    
+    @staticmethod
+    def _is_pcm_source(source: discord.AudioSource) -> bool:
+        return isinstance(source, (discord.PCMVolumeTransformer, DSPAudioSource))
+    
+    @classmethod
+    async def _open_source(cls, url: str, acodec: Optional[str], abr: Optional[float],
+                           volume: float, before_options: Optional[str]) -> discord.AudioSource:
+        """Запустить FFmpeg для потока или файла"""
+        # громкость не 100% или нужны эффекты — PCM, который обрабатываем на лету
+        if cls._wants_pcm(volume):
+            pcm = discord.FFmpegPCMAudio(
+                url,
+                executable=FFMPEG_EXECUTABLE,
+                before_options=before_options,
+                options="-vn"
+            )
+            # DSP-стадия медленнее PCMVolumeTransformer — только когда нужны её эффекты
+            if _dsp_effects_enabled():
+                return DSPAudioSource(pcm, volume=volume, normalize=MUSIC_NORMALIZE)
+            return discord.PCMVolumeTransformer(pcm, volume=volume)
+        
+        # 100%: Opus из источника уходит в войс без перекодирования
+        if acodec and acodec != "none":
+            # кодек и битрейт уже известны — отдельный ffprobe не нужен
+            return discord.FFmpegOpusAudio(
+                url,
+                bitrate=min(512, int(abr or 128)),
+                codec=acodec,
+                executable=FFMPEG_EXECUTABLE,
+                before_options=before_options,
+                options="-vn"
+            )
+        return await discord.FFmpegOpusAudio.from_probe(
+            url,
+            executable=FFMPEG_EXECUTABLE,
+            before_options=before_options,
+            options="-vn"
+        )
+    
+    async def _open_track(self, track: Track, offset: float = 0.0) -> discord.AudioSource:
+        """Открыть трек с позиции offset: локальная копия из кэша, иначе поток"""
+        # -ss перед -i: FFmpeg перематывает вход и не качает уже сыгранное
+        seek = f"-ss {offset:.2f}" if offset > 0 else ""
+        local = audio_cache.path_for(track) if audio_cache else None
+        if local:
+            return await self._open_source(local, "opus", None, self.volume, seek or None)
+        
+        # ссылка на поток могла протухнуть, пока трек ждал в очереди
+        resolved = await resolve_track(track)
+        return await self._open_source(
+            resolved.stream_url, resolved.acodec, resolved.abr, self.volume,
+            f"{seek} {FFMPEG_OPTIONS['before_options']}".strip()
+        )
+    
+    def _bind_source(self, source: discord.AudioSource, offset: float) -> discord.AudioSource:
+        """Сделать источник текущим и вернуть то, что отдаётся в войс"""
+        if self._is_pcm_source(source):
+            source.volume = self.volume
+            self.current_source = source
+        else:
+            self.current_source = None
+        # DSP-стадия считает кадры сама (и сбрасывает счёт после кроссфейда)
+        if not isinstance(source, DSPAudioSource):
+            source = FrameCounter(source)
+        self._frame_source = source
+        self._position_base = offset
+        return source
+    
+    @property
+    def position(self) -> float:
+        """Сколько секунд текущего трека уже отдано в войс"""
+        if self._frame_source is None:
+            return self._position_base
+        return self._position_base + self._frame_source.frames / DSPAudioSource.FRAMES_PER_SECOND
+    
+    @staticmethod
+    def _interrupted_at(track: Track, position: float) -> bool:
+        """Есть ли смысл продолжать трек с этой позиции, а не с начала"""
+        return bool(track.duration) and TRACK_EARLY_EXIT < position < track.duration - TRACK_EARLY_EXIT
+    
+    async def _seek(self, offset: float) -> bool:
+        """Переоткрыть текущий трек с позиции offset без остановки плеера"""
+        track = self.current_track
+        if track is None or not self.vc or not (self.vc.is_playing() or self.vc.is_paused()):
+            return False
+        offset = max(0.0, offset)
+        if track.duration:
+            offset = min(offset, max(0.0, track.duration - 1))
+        
+        self._drop_warm()
+        source = await self._open_track(track, offset)
+        if not (self.vc.is_playing() or self.vc.is_paused()):
+            # трек успел закончиться, пока открывался новый источник
+            source.cleanup()
+            return False
+        
+        paused = self.vc.is_paused()
+        old = self.vc.source
+        # подмена источника не вызывает after — для очереди трек не кончался
+        self.vc.source = self._bind_source(source, offset)
+        if paused:
+            self.vc.pause()
+        # аудиопоток мог ещё читать старый источник — закрываем его чуть позже
+        asyncio.get_running_loop().call_later(1.0, old.cleanup)
+        self._schedule_prewarm(track, elapsed=offset)
+        return True
+    
+    def set_volume(self, volume: float) -> bool:
+        """Сменить громкость; False — применится только со следующего трека"""
+        self.volume = volume
+        if self.current_source:
+            self.current_source.volume = volume
+            return True
+        return False
+    
+    async def _change_volume(self, volume: float) -> bool:
+        """Сменить громкость; при переходе Opus <-> PCM трек переоткрывается с той же позиции"""
+        playing = self.current_track and self.vc and (self.vc.is_playing() or self.vc.is_paused())
+        if playing and self._fading_track is None and (self.current_source is not None) != self._wants_pcm(volume):
+            self.volume = volume
+            try:
+                return await self._seek(self.position)
+            except Exception as e:
+                logging.warning(f"Не удалось переоткрыть трек для смены громкости: {e}")
+                return False
+        return self.set_volume(volume)
+    
+    def _record_gap(self):
+        """Тишина между концом прошлого трека и стартом нового"""
+        if self._last_track_end is None:
+            return
+        gap = time.perf_counter() - self._last_track_end
+        self._last_track_end = None
+        self.last_gap = gap
+        self.gap_total += gap
+        self.gap_count += 1
+    
+    @property
+    def avg_gap(self) -> Optional[float]:
+        return self.gap_total / self.gap_count if self.gap_count else None
+    
+    def _schedule_prewarm(self, current: Track, elapsed: float = 0.0):
+        """Открыть источник следующего трека незадолго до конца текущего"""
+        if self._warm_task:
+            self._warm_task.cancel()
+        self._warm_task = None
+        if not current.duration:
+            return
+        lead = max(PREWARM_LEAD, MUSIC_CROSSFADE_SECONDS + 5)
+        delay = max(0.0, current.duration - lead - elapsed)
+        self._warm_task = asyncio.create_task(self._prewarm_after(delay))
+    
+    async def _prewarm_after(self, delay: float):
+        await asyncio.sleep(delay)
+        if not self.queue:
+            return
+        track = self.queue[0]
+        try:
+            source = await self._open_track(track)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Прогрев не удался ({track.title}): {e}")
+            return
+        
+        self._drop_warm()
+        if not self.queue or self.queue[0] is not track:
+            source.cleanup()
+            return
+        
+        if (MUSIC_CROSSFADE_SECONDS > 0 and isinstance(self.current_source, DSPAudioSource)
+                and isinstance(source, DSPAudioSource) and self.current_track and self.current_track.duration):
+            self._start_crossfade(self.current_source, track, source)
+        else:
+            self._warm = (track, source, time.monotonic())
+    
+    def _start_crossfade(self, dsp: DSPAudioSource, track: Track, source: DSPAudioSource):
+        """Передать следующий трек в DSP-стадию текущего для плавного перехода"""
+        # трек остаётся в очереди до фактического переключения: при пропуске
+        # или обрыве он просто сыграет следующим в обычном порядке
+        self._fading_track = track
+        fps = DSPAudioSource.FRAMES_PER_SECOND
+        # DSP считает кадры от места, с которого открыт источник
+        start_frame = int((self.current_track.duration - MUSIC_CROSSFADE_SECONDS - self._position_base) * fps)
+        loop = asyncio.get_running_loop()
+        
+        def on_switch(switched: bool):
+            loop.call_soon_threadsafe(self.submit, "crossfade", (track, switched))
+        
+        dsp.crossfade_to(source.original, start_frame, int(MUSIC_CROSSFADE_SECONDS * fps), on_switch)
+    
+    def _on_crossfade_done(self, track: Track, switched: bool):
+        if self._fading_track is not track:
+            return
+        self._fading_track = None
+        if not switched:
+            return
+        
+        for index, queued in enumerate(self.queue):
+            if queued is track:
+                self.queue.remove(index)
+                break
+        self.current_track = track
+        self._track_started_at = time.monotonic()
+        self._position_base = 0.0
+        self.last_gap = 0.0
+        self.gap_count += 1
+        self.prefetch_upcoming()
+        self._schedule_prewarm(track, elapsed=MUSIC_CROSSFADE_SECONDS)
+        asyncio.create_task(self.update_control_message())
+    
+    def _take_warm(self, track: Track) -> Optional[discord.AudioSource]:
+        """Забрать прогретый источник, если он для этого трека и не устарел"""
+        warm = self._warm
+        self._warm = None
+        if warm is None:
+            return None
+        warm_track, source, opened_at = warm
+        same_mode = self._is_pcm_source(source) == self._wants_pcm(self.volume)
+        if warm_track is track and same_mode and not track.start_at and time.monotonic() - opened_at <= WARM_SOURCE_MAX_AGE:
+            return source
+        source.cleanup()
+        return None
+    
+    def _drop_warm(self):
+        if self._warm:
+            self._warm[1].cleanup()
+            self._warm = None
+    
+    def prefetch_upcoming(self):
+        """Заранее получить ссылки на поток для ближайших треков очереди"""
+        for track in self.queue.page(0, PREFETCH_AHEAD):
+            if track.needs_resolve:
+                task = asyncio.create_task(self._prefetch(track))
+                self._prefetch_tasks.add(task)
+                task.add_done_callback(self._prefetch_tasks.discard)
+    
+    @staticmethod
+    async def _prefetch(track: Track):
+        try:
+            await resolve_track(track)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Предзагрузка не удалась ({track.title}): {e}")
+    
+    async def stop_and_cleanup(self):
+        """Остановить плеер и очистить ресурсы"""
+        try:
+            if self.vc and self.vc.is_connected():
+                await self.vc.disconnect(force=True)
+        except Exception as e:
+            logging.error(f"Ошибка отключения: {e}")
+        
+        self._panel_closed = True
+        if self._panel_task:
+            self._panel_task.cancel()
+            self._panel_task = None
+        
+        # обновление, которое уже идёт, сначала допишется — удаляем после него
+        async with self._panel_lock:
+            if self.control_message:
+                try:
+                    panel_api_calls.record(self.guild.id)
+                    await self.control_message.delete()
+                except Exception:
+                    pass
+                self.control_message = None
+                self._panel_rendered = None
+        
+        for task in list(self._prefetch_tasks):
+            task.cancel()
+        if self._ingest_task:
+            self._ingest_task.cancel()
+            self._ingest_task = None
+        if self._warm_task:
+            self._warm_task.cancel()
+            self._warm_task = None
+        self._drop_warm()
+        self._fading_track = None
+        if self._breaker_retry:
+            self._breaker_retry.cancel()
+            self._breaker_retry = None
+        
+        self.current_track = None
+        self.current_source = None
+        self._frame_source = None
+        self._position_base = 0.0
+        self.queue.clear()
+        drop_player_snapshot(self.guild.id)
+    
+    async def update_control_message(self):
+        """Запланировать обновление панели (изменения за окно склеиваются)"""
+        if self._panel_closed:
+            return
+        if self._panel_task is None or self._panel_task.done():
+            self._panel_task = asyncio.create_task(self._delayed_panel_flush())
+    
+    async def _delayed_panel_flush(self):
+        await asyncio.sleep(CONTROL_UPDATE_DELAY)
+        # дальше изменения планируют новое обновление, а не теряются
+        self._panel_task = None
+        async with self._panel_lock:
+            if not self._panel_closed:
+                await self._flush_control_message()
+    
+    def _render_control_embed(self) -> discord.Embed:
+        if self.vc.is_playing():
+            status = "▶️ Воспроизведение"
+        elif self.vc.is_paused():
+            status = "⏸ Пауза"
+        else:
+            status = "❌ Не играет"
+        
+        current_title = self.current_track.title if self.current_track else "Нет трека"
+        
+        queue_lines = []
+        for i, track in enumerate(self.queue.page(0, 10), 1):
+            queue_lines.append(f"{i}. {track.title}")
+        queue_text = "\n".join(queue_lines) or "Очередь пуста"
+        
+        vol_pct = int(self.volume * 100)
+        description = (
+            f"**Сейчас играет:** {current_title}\n\n"
+            f"📃 **Очередь ({len(self.queue)}):**\n{queue_text}\n\n"
+            f"🔊 **Громкость:** {vol_pct}%"
+        )
+        
+        embed = discord.Embed(
+            title=f"🎶 Музыкальный плеер — {status}",
+            description=description,
+            color=discord.Color.green()
+        )
+        
+        if self.current_track and self.current_track.thumbnail:
+            embed.set_thumbnail(url=self.current_track.thumbnail)
+        return embed
+    
+    async def _flush_control_message(self):
+        """Отправить панель, если она действительно изменилась"""
+        embed = self._render_control_embed()
+        rendered = embed.to_dict()
+        
+        if self.control_message:
+            if rendered == self._panel_rendered:
+                self.panel_skipped += 1
+                return
+            try:
+                # кнопки уже висят на сообщении — меняем только embed
+                panel_api_calls.record(self.guild.id)
+                await self.control_message.edit(embed=embed)
+                self._panel_rendered = rendered
+                return
+            except discord.NotFound:
+                # панель удалили руками — пришлём новую
+                self.control_message = None
+            except Exception as e:
+                logging.warning(f"Ошибка обновления панели: {e}")
+                return
+        
+        try:
+            panel_api_calls.record(self.guild.id)
+            self.control_message = await self.text_channel.send(embed=embed, view=get_music_control_view())
+            self._panel_rendered = rendered
+        except Exception as e:
+            logging.error(f"Ошибка отправки панели: {e}")
+    
+    def snapshot(self) -> dict:
+        """Состояние для продолжения после перезапуска (без очереди — она в queue_snapshot)"""
+        vc = self.vc
+        return {
+            # меняется вместе с очередью: по нему видно, пора ли переписать player_queues
+            "signature": [self.queue.revision, id(self.queue)],
+            "saved_at": time.time(),
+            "voice_channel_id": vc.channel.id if vc and vc.channel else None,
+            "text_channel_id": getattr(self.text_channel, "id", None),
+            "message_id": self.control_message.id if self.control_message else None,
+            "volume": self.volume,
+            "playing": bool(vc and vc.is_playing()),
+            "current": self.current_track.describe() if self.current_track else None,
+            "position": round(self.position, 1) if self.current_track else 0.0,
+        }
+    
+    def queue_snapshot(self) -> list:
+        return [track.describe() for track in self.queue.page(0, PLAYER_SNAPSHOT_MAX_TRACKS)]
+    
+    def restore(self, snapshot: dict, queue: list):
+        """Восстановить очередь, громкость и панель из снимка"""
+        self.volume = snapshot.get("volume", self.volume)
+        current = snapshot.get("current")
+        if current:
+            track = Track.from_description(current)
+            track.start_at = snapshot.get("position") or 0.0
+            self.queue.append(track)
+        for data in queue:
+            self.queue.append(Track.from_description(data))
+        
+        message_id = snapshot.get("message_id")
+        if message_id and snapshot.get("text_channel_id") == getattr(self.text_channel, "id", None):
+            # старая панель продолжает работать: кнопки постоянные, embed обновится
+            self.control_message = self.text_channel.get_partial_message(message_id)
+    
+    def idle_reason(self, now: float) -> Optional[str]:
+        """Причина отключить плеер сборщиком (None — плеер нужен)"""
+        vc = self.vc
+        if not vc or not vc.is_connected():
+            self.alone_since = None
+            self.paused_since = None
+            self.idle_since = self.idle_since or now
+            if now - self.idle_since >= MUSIC_DISCONNECTED_GRACE:
+                return "нет голосового подключения"
+            return None
+        
+        if vc.is_playing():
+            self.idle_since = None
+            self.paused_since = None
+        elif vc.is_paused():
+            self.idle_since = None
+            self.paused_since = self.paused_since or now
+        else:
+            self.paused_since = None
+            self.idle_since = self.idle_since or now
+        
+        listeners = [m for m in getattr(vc.channel, "members", []) if not m.bot]
+        if listeners:
+            self.alone_since = None
+        else:
+            self.alone_since = self.alone_since or now
+        
+        if self.alone_since is not None and now - self.alone_since >= MUSIC_ALONE_TIMEOUT:
+            return "в канале никого нет"
+        if self.idle_since is not None and now - self.idle_since >= MUSIC_IDLE_TIMEOUT:
+            return "простой"
+        if self.paused_since is not None and now - self.paused_since >= MUSIC_PAUSED_TIMEOUT:
+            return "долгая пауза"
+        return None
+    
+    def ffmpeg_pids(self) -> set:
+        """PID процессов FFmpeg, которые принадлежат этому плееру"""
+        pids = set()
+        sources = [self.current_source, self._warm[1] if self._warm else None]
+        if self.vc:
+            sources.append(self.vc.source)
+        for source in sources:
+            # обёртки (громкость, DSP) хранят исходник в .original
+            while source is not None:
+                process = getattr(source, "_process", None)
+                if process is not None:
+                    pids.add(process.pid)
+                incoming = getattr(source, "_incoming", None)
+                if incoming is not None and getattr(incoming, "_process", None) is not None:
+                    pids.add(incoming._process.pid)
+                source = getattr(source, "original", None)
+        return pids
+    
+    def pause(self):
+        if self.vc and self.vc.is_playing():
+            self.vc.pause()
+    
+    def resume(self):
+        if self.vc and self.vc.is_paused():
+            self.vc.resume()
+    
+    def stop(self):
+        if self.vc and (self.vc.is_playing() or self.vc.is_paused()):
+            self._stop_requested = True
+            self.vc.stop()
+
+
+class VoiceScheduler:
+    """Реестр плееров: создание, остановка воркеров и сводные метрики"""
+    
+    def __init__(self, players: Dict[int, MusicPlayer]):
+        self.players = players
+    
+    def get_or_create(self, guild: discord.Guild, vc: discord.VoiceClient,
+                      text_channel: discord.abc.Messageable) -> MusicPlayer:
+        player = self.players.get(guild.id)
+        if player is None:
+            player = MusicPlayer(guild, vc, text_channel)
+            self.players[guild.id] = player
+            snapshot = player_snapshots.get(guild.id)
+            if snapshot and time.time() - snapshot.get("saved_at", 0) <= PLAYER_SNAPSHOT_MAX_AGE:
+                # плеер с прошлого запуска: очередь продолжается с того же места
+                player.restore(snapshot, player_queues.get(guild.id, []))
+        else:
+            player.vc = vc
+            player.text_channel = text_channel
+        return player
+    
+    async def shutdown(self, guild_id: int):
+        player = self.players.pop(guild_id, None)
+        if player:
+            await player.close()
+    
+    def stats(self) -> dict:
+        players = list(self.players.values())
+        handled = sum(p.commands_handled for p in players)
+        total = sum(p.command_latency_total for p in players)
+        return {
+            "players": len(players),
+            "pending": sum(p.queue_depth for p in players),
+            "max_depth": max((p.queue_depth for p in players), default=0),
+            "avg_latency": total / handled if handled else None,
+        }
+
+
+voice_scheduler = VoiceScheduler(music_players)
+
+
+class MusicControlView(View):
+    """Панель управления музыкой"""
+    
+    def __init__(self):
+        super().__init__(timeout=None)
+    
+    @staticmethod
+    def _get_player(interaction: Interaction) -> Optional[MusicPlayer]:
+        if not interaction.guild:
+            return None
+        return music_players.get(interaction.guild.id)
+    
+    @discord.ui.button(label="⏯ Вкл/Пауза", style=ButtonStyle.primary, custom_id="mp_toggle")
+    async def pause_resume(self, interaction: Interaction, _: Button):
+        player = self._get_player(interaction)
+        if not player or not player.vc or not player.vc.is_connected():
+            await interaction.response.send_message("❌ Бот не подключен", ephemeral=True)
+            return
+        
+        await interaction.response.defer(ephemeral=True)
+        
+        if player.vc.is_paused():
+            player.resume()
+        elif player.vc.is_playing():
+            player.pause()
+        
+        await player.update_control_message()
+    
+    @discord.ui.button(label="⏭ Пропустить", style=ButtonStyle.secondary, custom_id="mp_skip")
+    async def skip(self, interaction: Interaction, _: Button):
+        player = self._get_player(interaction)
+        await interaction.response.defer(ephemeral=True)
+        
+        if player:
+            try:
+                await player.command("skip")
+            except PlayerClosed:
+                return
+            await player.update_control_message()
+    
+    @discord.ui.button(label="🔉 Тише", style=ButtonStyle.secondary, custom_id="mp_quieter")
+    async def volume_down(self, interaction: Interaction, _: Button):
+        player = self._get_player(interaction)
+        await interaction.response.defer(ephemeral=True)
+        
+        if player:
+            try:
+                await player.command("volume", max(0.0, round(player.volume - 0.1, 2)))
+            except PlayerClosed:
+                return
+            await player.update_control_message()
+    
+    @discord.ui.button(label="🔊 Громче", style=ButtonStyle.secondary, custom_id="mp_louder")
+    async def volume_up(self, interaction: Interaction, _: Button):
         player = self._get_player(interaction)
         await interaction.response.defer(ephemeral=True)
         
-        if player:
-            player.stop()
-            await player.update_control_message()
-    
-    @discord.ui.button(label="🔉 Тише", style=ButtonStyle.secondary, custom_id="mp_quieter")
-    async def volume_down(self, interaction: Interaction, _: Button):
-        player = self._get_player(interaction)
-        await interaction.response.defer(ephemeral=True)
+        if player:
+            try:
+                await player.command("volume", min(2.0, round(player.volume + 0.1, 2)))
+            except PlayerClosed:
+                return
+            await player.update_control_message()
+    
+    @discord.ui.button(label="🔀 Перемешать", style=ButtonStyle.secondary, custom_id="mp_shuffle")
+    async def shuffle(self, interaction: Interaction, _: Button):
+        player = self._get_player(interaction)
+        await interaction.response.defer(ephemeral=True)
+        
+        if player and player.queue:
+            player.queue.shuffle()
+            await player.update_control_message()
+    
+    @discord.ui.button(label="🛑 Стоп", style=ButtonStyle.danger, custom_id="mp_stop")
+    async def hard_stop(self, interaction: Interaction, _: Button):
+        player = self._get_player(interaction)
+        await interaction.response.defer(ephemeral=True)
+        
+        if player:
+            await voice_scheduler.shutdown(interaction.guild.id)
+
+
+# ============================================================================
+# СБОРЩИК ПРОСТАИВАЮЩИХ ПЛЕЕРОВ
+# ============================================================================
+
+reaper_totals = {"players": 0, "ffmpeg": 0, "fds": 0, "bytes": 0}
+_reaper_task: Optional[asyncio.Task] = None
+
+
+def _open_fd_count() -> int:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _child_ffmpeg_processes() -> List[Tuple[int, float]]:
+    """Дочерние процессы ffmpeg этого бота: (pid, возраст в секундах)"""
+    try:
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except (OSError, ValueError):
+        return []
+    
+    me = os.getpid()
+    ticks = os.sysconf("SC_CLK_TCK")
+    found = []
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # имя процесса в скобках может содержать пробелы
+        comm = stat[stat.index("(") + 1:stat.rindex(")")]
+        fields = stat[stat.rindex(")") + 2:].split()
+        if int(fields[1]) != me or not comm.startswith("ffmpeg"):
+            continue
+        found.append((pid, uptime - int(fields[19]) / ticks))
+    return found
+
+
+def _kill_orphan_ffmpeg() -> int:
+    """Убить процессы ffmpeg, которые не принадлежат ни одному живому источнику"""
+    owned = set(audio_cache.active_pids) if audio_cache else set()
+    for player in music_players.values():
+        owned |= player.ffmpeg_pids()
+    
+    killed = 0
+    for pid, age in _child_ffmpeg_processes():
+        # свежий процесс мог ещё не попасть в источник плеера
+        if pid in owned or age < ORPHAN_FFMPEG_MIN_AGE:
+            continue
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, os.WNOHANG)
+            killed += 1
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        except OSError as e:
+            logging.warning(f"Не удалось завершить ffmpeg {pid}: {e}")
+    return killed
+
+
+async def reap_music_players():
+    """Один проход сборщика: простаивающие плееры, лишние войсы и сироты ffmpeg"""
+    fds_before, rss_before = _open_fd_count(), _rss_bytes()
+    now = time.monotonic()
+    
+    reaped = []
+    for guild_id, player in list(music_players.items()):
+        reason = player.idle_reason(now)
+        if reason:
+            reaped.append((guild_id, reason))
+            await voice_scheduler.shutdown(guild_id)
+    
+    # войсы без плеера (например, после падения команды)
+    for vc in list(bot.voice_clients):
+        guild = getattr(vc, "guild", None)
+        if guild and guild.id not in music_players:
+            try:
+                await vc.disconnect(force=True)
+                reaped.append((guild.id, "голосовое подключение без плеера"))
+            except Exception as e:
+                logging.error(f"Ошибка отключения: {e}")
+    
+    killed = _kill_orphan_ffmpeg()
+    if not reaped and not killed:
+        return
+    
+    fds_freed = max(0, fds_before - _open_fd_count())
+    bytes_freed = max(0, rss_before - _rss_bytes())
+    reaper_totals["players"] += len(reaped)
+    reaper_totals["ffmpeg"] += killed
+    reaper_totals["fds"] += fds_freed
+    reaper_totals["bytes"] += bytes_freed
+    
+    details = ", ".join(f"{gid} ({reason})" for gid, reason in reaped) or "—"
+    logging.info(
+        f"🧹 Сборщик: отключено {len(reaped)} [{details}], убито ffmpeg: {killed}, "
+        f"освобождено дескрипторов: {fds_freed}, памяти: {bytes_freed / 1024 ** 2:.1f} МБ"
+    )
+
+
+async def _music_reaper_loop():
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL)
+        try:
+            await reap_music_players()
+        except Exception as e:
+            logging.error(f"Ошибка сборщика плееров: {e}")
+
+
+def start_music_reaper():
+    global _reaper_task
+    if _reaper_task is None or _reaper_task.done():
+        _reaper_task = asyncio.create_task(_music_reaper_loop())
+
+
+# ============================================================================
+# СНИМКИ ПЛЕЕРОВ
+# ============================================================================
+
+_snapshot_task: Optional[asyncio.Task] = None
+_rehydrate_task: Optional[asyncio.Task] = None
+
+
+def drop_player_snapshot(guild_id: int):
+    for namespace in ("player_snapshots", "player_queues"):
+        if SHARED_STATE[namespace].pop(guild_id, None) is not None:
+            _publish(namespace, guild_id)
+
+
+def snapshot_players():
+    """Сохранить состояние всех плееров (запись уйдёт пачкой с остальными настройками)"""
+    for guild_id, player in list(music_players.items()):
+        if not player.current_track and not player.queue:
+            continue
+        previous = player_snapshots.get(guild_id)
+        snapshot = player.snapshot()
+        if previous and {**previous, "saved_at": 0} == {**snapshot, "saved_at": 0}:
+            continue
+        # позиция меняется каждый тик, очередь — редко: большую запись трогаем только при изменении
+        if previous is None or previous.get("signature") != snapshot["signature"] or guild_id not in player_queues:
+            player_queues[guild_id] = player.queue_snapshot()
+            _publish("player_queues", guild_id)
+        player_snapshots[guild_id] = snapshot
+        _publish("player_snapshots", guild_id)
+    
+    # снимки прошлого запуска, которые так и не понадобились
+    now = time.time()
+    for guild_id, snapshot in list(player_snapshots.items()):
+        if guild_id not in music_players and now - snapshot.get("saved_at", 0) > PLAYER_SNAPSHOT_MAX_AGE:
+            drop_player_snapshot(guild_id)
+
+
+async def _player_snapshot_loop():
+    while True:
+        await asyncio.sleep(PLAYER_SNAPSHOT_INTERVAL)
+        try:
+            snapshot_players()
+        except Exception as e:
+            logging.error(f"Ошибка снимка плееров: {e}")
+
+
+async def _rehydrate_players():
+    """После перезапуска: вернуться в войс там, где музыка играла, остальное — лениво"""
+    restored = 0
+    for guild_id, snapshot in list(player_snapshots.items()):
+        guild = bot.get_guild(guild_id)
+        if guild is None or guild_id in music_players:
+            # сервер другого процесса кластера или плеер уже создан командой
+            continue
+        
+        text_channel = guild.get_channel(snapshot.get("text_channel_id") or 0)
+        if time.time() - snapshot.get("saved_at", 0) > PLAYER_SNAPSHOT_MAX_AGE or text_channel is None:
+            drop_player_snapshot(guild_id)
+            if text_channel is not None and snapshot.get("message_id"):
+                try:
+                    await text_channel.get_partial_message(snapshot["message_id"]).delete()
+                except discord.HTTPException:
+                    pass
+            continue
         
-        if player:
-            player.volume = max(0.0, round(player.volume - 0.1, 2))
-            if player.current_source:
-                player.current_source.volume = player.volume
-            await player.update_control_message()
-    
-    @discord.ui.button(label="🔊 Громче", style=ButtonStyle.secondary, custom_id="mp_louder")
-    async def volume_up(self, interaction: Interaction, _: Button):
-        player = self._get_player(interaction)
-        await interaction.response.defer(ephemeral=True)
+        channel = guild.get_channel(snapshot.get("voice_channel_id") or 0)
+        if not snapshot.get("playing") or not isinstance(channel, discord.VoiceChannel):
+            # не играло — плеер восстановится при следующем /play
+            continue
+        if not any(not m.bot for m in channel.members):
+            continue
         
-        if player:
-            player.volume = min(2.0, round(player.volume + 0.1, 2))
-            if player.current_source:
-                player.current_source.volume = player.volume
-            await player.update_control_message()
+        try:
+            vc = guild.voice_client or await channel.connect()
+            for _ in range(50):
+                if vc.is_connected():
+                    break
+                await asyncio.sleep(0.1)
+            player = voice_scheduler.get_or_create(guild, vc, text_channel)
+            player.submit("play")
+            restored += 1
+        except Exception as e:
+            logging.error(f"Не удалось восстановить плеер сервера {guild_id}: {e}")
+        # подключения к войсу растягиваем, чтобы не упереться в лимиты
+        await asyncio.sleep(1)
     
-    @discord.ui.button(label="🛑 Стоп", style=ButtonStyle.danger, custom_id="mp_stop")
-    async def hard_stop(self, interaction: Interaction, _: Button):
-        player = self._get_player(interaction)
-        await interaction.response.defer(ephemeral=True)
-        
-        if player:
-            player.stop()
-            await player.stop_and_cleanup()
-            music_players.pop(interaction.guild.id, None)
+    if restored:
+        logging.info(f"▶️ Восстановлено плееров после перезапуска: {restored}")
+
+
+def start_player_snapshots():
+    global _snapshot_task, _rehydrate_task
+    if _snapshot_task is None or _snapshot_task.done():
+        _snapshot_task = asyncio.create_task(_player_snapshot_loop())
+    if _rehydrate_task is None:
+        _rehydrate_task = asyncio.create_task(_rehydrate_players())
 
 
 # ============================================================================
@@ -851,8 +3485,39 @@ class CloseTicketView(discord.ui.View):
 # КОМАНДЫ - МУЗЫКА
 # ============================================================================
 
+def _split_queries(query: str) -> List[str]:
+    """Несколько запросов в одной строке: через ';' или с новой строки"""
+    if _is_playlist_url(query):
+        return [query]
+    return [q.strip() for q in re.split(r"[;\n]", query) if q.strip()]
+
+
+async def _play_batch(interaction: Interaction, player: MusicPlayer, vc: discord.VoiceClient, queries: List[str]):
+    """Добавить пачку треков: одно итоговое сообщение и одно обновление панели"""
+    skipped = len(queries) - BATCH_MAX_QUERIES
+    queries = queries[:BATCH_MAX_QUERIES]
+    results = await player.add_tracks(queries)
+    
+    added = sum(1 for ok, _ in results if ok)
+    lines = [f"📥 Добавлено треков: **{added}** из {len(queries)}"]
+    for i, (ok, message) in enumerate(results, 1):
+        lines.append(f"{i}. {message}" if ok else f"{i}. {queries[i - 1][:60]} — {message}")
+    if skipped > 0:
+        lines.append(f"… ещё {skipped} запросов не обработано (максимум {BATCH_MAX_QUERIES})")
+    
+    text = "\n".join(lines)
+    if len(text) > 2000:
+        text = text[:1997] + "..."
+    
+    if added and not vc.is_playing() and not vc.is_paused():
+        await player.play_next()
+    elif added:
+        await player.update_control_message()
+    await interaction.followup.send(text, ephemeral=not added)
+
+
 @bot.tree.command(name="play", description="Воспроизвести музыку")
-@app_commands.describe(query="Название трека или ссылка")
+@app_commands.describe(query="Название трека или ссылка; несколько — через точку с запятой")
 async def play_cmd(interaction: Interaction, query: str):
     await interaction.response.defer()
     
@@ -862,7 +3527,6 @@ async def play_cmd(interaction: Interaction, query: str):
     
     voice_channel = interaction.user.voice.channel
     guild = interaction.guild
-    guild_id = guild.id
     
     vc = discord.utils.get(bot.voice_clients, guild=guild)
     if not vc:
@@ -879,15 +3543,17 @@ async def play_cmd(interaction: Interaction, query: str):
         await interaction.followup.send("❌ Не удалось подключиться к голосовому каналу", ephemeral=True)
         return
     
-    player = music_players.get(guild_id)
-    if not player:
-        player = MusicPlayer(guild, vc, interaction.channel)
-        music_players[guild_id] = player
-    else:
-        player.vc = vc
-        player.text_channel = interaction.channel
+    player = voice_scheduler.get_or_create(guild, vc, interaction.channel)
+    
+    queries = _split_queries(query)
+    if len(queries) > 1:
+        await _play_batch(interaction, player, vc, queries)
+        return
     
-    success, message = await player.add_track(query)
+    if _is_playlist_url(query):
+        success, message = await player.add_playlist(query)
+    else:
+        success, message = await player.add_track(query)
     
     if not success:
         await interaction.followup.send(message, ephemeral=True)
@@ -900,6 +3566,19 @@ async def play_cmd(interaction: Interaction, query: str):
         await interaction.followup.send(message, ephemeral=True)
 
 
+@play_cmd.autocomplete("query")
+async def play_query_autocomplete(interaction: Interaction, current: str) -> List[app_commands.Choice[str]]:
+    suggestions = await suggest_tracks(interaction.user.id, current)
+    choices = []
+    for title, url, duration in suggestions:
+        name = title
+        if duration:
+            minutes, seconds = divmod(int(duration), 60)
+            name = f"{title} [{minutes}:{seconds:02d}]"
+        choices.append(app_commands.Choice(name=name[:100], value=url))
+    return choices
+
+
 @bot.tree.command(name="queue", description="Показать очередь")
 @app_commands.describe(page="Номер страницы")
 async def queue_cmd(interaction: Interaction, page: Optional[int] = 1):
@@ -913,15 +3592,14 @@ async def queue_cmd(interaction: Interaction, page: Optional[int] = 1):
     page = max(1, page or 1)
     per_page = 20
     start = (page - 1) * per_page
-    end = start + per_page
     
     lines = []
     if player.current_track:
-        lines.append(f"**Сейчас:** {player.current_track[0]}")
+        lines.append(f"**Сейчас:** {player.current_track.title}")
     
     if player.queue:
-        for i, track in enumerate(player.queue[start:end], start=start + 1):
-            lines.append(f"{i}. {track[0]}")
+        for i, track in enumerate(player.queue.page(start, per_page), start=start + 1):
+            lines.append(f"{i}. {track.title}")
     
     text = "\n".join(lines) or "Очередь пуста"
     total_pages = max(1, (len(player.queue) + per_page - 1) // per_page)
@@ -938,11 +3616,59 @@ async def skip_cmd(interaction: Interaction):
         await interaction.followup.send("❌ Ничего не играет", ephemeral=True)
         return
     
-    player.stop()
+    try:
+        await player.command("skip")
+    except PlayerClosed:
+        await interaction.followup.send("❌ Ничего не играет", ephemeral=True)
+        return
     await player.update_control_message()
     await interaction.followup.send("⏭ Пропущено", ephemeral=True)
 
 
+def _parse_timestamp(value: str) -> Optional[float]:
+    """'90', '1:30' или '1:02:30' в секунды"""
+    try:
+        parts = [float(p) for p in value.strip().split(":")]
+    except ValueError:
+        return None
+    if not parts or len(parts) > 3 or any(p < 0 for p in parts):
+        return None
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+@bot.tree.command(name="seek", description="Перемотать текущий трек")
+@app_commands.describe(position="Позиция: секунды или мм:сс")
+async def seek_cmd(interaction: Interaction, position: str):
+    await interaction.response.defer(ephemeral=True)
+    
+    offset = _parse_timestamp(position)
+    if offset is None:
+        await interaction.followup.send("❌ Укажите позицию как 90 или 1:30", ephemeral=True)
+        return
+    
+    player = music_players.get(interaction.guild.id)
+    if not player or not player.current_track:
+        await interaction.followup.send("❌ Ничего не играет", ephemeral=True)
+        return
+    
+    try:
+        moved = await player.command("seek", offset)
+    except PlayerClosed:
+        moved = False
+    except Exception as e:
+        await interaction.followup.send(f"❌ Не удалось перемотать: {e}", ephemeral=True)
+        return
+    
+    if not moved:
+        await interaction.followup.send("❌ Ничего не играет", ephemeral=True)
+        return
+    minutes, seconds = divmod(int(player.position), 60)
+    await interaction.followup.send(f"⏩ Перемотано на {minutes}:{seconds:02d}", ephemeral=True)
+
+
 @bot.tree.command(name="pause", description="Пауза/Продолжить воспроизведение")
 async def pause_cmd(interaction: Interaction):
     await interaction.response.defer(ephemeral=True)
@@ -979,11 +3705,59 @@ async def remove_cmd(interaction: Interaction, index: int):
         await interaction.followup.send("Неверный номер", ephemeral=True)
         return
     
-    title = player.queue.pop(index - 1)[0]
+    title = player.queue.remove(index - 1).title
     await player.update_control_message()
     await interaction.followup.send(f"🗑 Удалён: **{title}**", ephemeral=True)
 
 
+@bot.tree.command(name="move", description="Переместить трек в очереди")
+@app_commands.describe(index="Номер трека (см. /queue)", position="Новая позиция")
+async def move_cmd(interaction: Interaction, index: int, position: int):
+    await interaction.response.defer(ephemeral=True)
+    
+    player = music_players.get(interaction.guild.id)
+    if not player or not player.queue:
+        await interaction.followup.send("Очередь пуста", ephemeral=True)
+        return
+    
+    if index < 1 or index > len(player.queue):
+        await interaction.followup.send("Неверный номер", ephemeral=True)
+        return
+    
+    track = player.queue.move(index - 1, position - 1)
+    await player.update_control_message()
+    await interaction.followup.send(f"↕️ **{track.title}** перемещён на позицию {max(1, min(position, len(player.queue)))}", ephemeral=True)
+
+
+@bot.tree.command(name="shuffle", description="Перемешать очередь")
+async def shuffle_cmd(interaction: Interaction):
+    await interaction.response.defer(ephemeral=True)
+    
+    player = music_players.get(interaction.guild.id)
+    if not player or not player.queue:
+        await interaction.followup.send("Очередь пуста", ephemeral=True)
+        return
+    
+    player.queue.shuffle()
+    await player.update_control_message()
+    await interaction.followup.send("🔀 Очередь перемешана", ephemeral=True)
+
+
+@bot.tree.command(name="dedupe", description="Убрать повторяющиеся треки из очереди")
+async def dedupe_cmd(interaction: Interaction):
+    await interaction.response.defer(ephemeral=True)
+    
+    player = music_players.get(interaction.guild.id)
+    if not player or not player.queue:
+        await interaction.followup.send("Очередь пуста", ephemeral=True)
+        return
+    
+    removed = player.queue.dedupe()
+    if removed:
+        await player.update_control_message()
+    await interaction.followup.send(f"🧹 Удалено повторов: **{removed}**", ephemeral=True)
+
+
 @bot.tree.command(name="stop", description="Остановить и очистить очередь")
 async def stop_cmd(interaction: Interaction):
     await interaction.response.defer(ephemeral=True)
@@ -993,15 +3767,72 @@ async def stop_cmd(interaction: Interaction):
         await interaction.followup.send("Уже остановлено", ephemeral=True)
         return
     
-    try:
-        player.stop()
-        await player.stop_and_cleanup()
-    finally:
-        music_players.pop(interaction.guild.id, None)
+    await voice_scheduler.shutdown(interaction.guild.id)
     
     await interaction.followup.send("🛑 Остановлено и очищено", ephemeral=True)
 
 
+@bot.tree.command(name="shard_stats", description="Нагрузка по шардам")
+async def shard_stats_cmd(interaction: Interaction):
+    guilds: Dict[int, int] = {}
+    for guild in bot.guilds:
+        guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+    players: Dict[int, int] = {}
+    for guild_id in music_players:
+        shard_id = shard_of(guild_id)
+        players[shard_id] = players.get(shard_id, 0) + 1
+    
+    lines = [f"🔷 Шардов: {bot.shard_count or 1}, этот сервер — шард {shard_of(interaction.guild.id)}"]
+    for shard_id, latency in sorted(bot.latencies):
+        ping = f"{latency * 1000:.0f} мс" if math.isfinite(latency) else "—"
+        lines.append(
+            f"`#{shard_id}` пинг {ping}, серверов {guilds.get(shard_id, 0)}, "
+            f"событий/мин {bot.events_per_minute(shard_id)}, плееров {players.get(shard_id, 0)}"
+        )
+    
+    text = "\n".join(lines)
+    if len(text) > 2000:
+        text = text[:1997] + "..."
+    await interaction.response.send_message(text, ephemeral=True)
+
+
+@bot.tree.command(name="music_stats", description="Статистика музыкального плеера")
+async def music_stats_cmd(interaction: Interaction):
+    player = music_players.get(interaction.guild.id)
+    
+    def fmt_ms(value: Optional[float]) -> str:
+        return f"{value * 1000:.0f} мс" if value is not None else "—"
+    
+    lines = []
+    if player:
+        lines.append(f"🎵 Треков в очереди: **{len(player.queue)}**")
+        lines.append(f"⏱ Пауза между треками: последняя {fmt_ms(player.last_gap)}, "
+                     f"средняя {fmt_ms(player.avg_gap)} ({player.gap_count} переходов)")
+        lines.append(f"📨 Команды плеера: в очереди {player.queue_depth}, выполнено {player.commands_handled}, "
+                     f"задержка средняя {fmt_ms(player.avg_command_latency)}, макс. {fmt_ms(player.command_latency_max)}")
+        lines.append(f"🖼 Обновления панели: {panel_api_calls.per_minute(interaction.guild.id)} вызовов API/мин, "
+                     f"пропущено без изменений: {player.panel_skipped}")
+    else:
+        lines.append("🎵 Плеер на этом сервере не запущен")
+    
+    sched = voice_scheduler.stats()
+    if reaper_totals["players"] or reaper_totals["ffmpeg"]:
+        lines.append(f"🧹 Сборщик: отключено плееров {reaper_totals['players']}, убито ffmpeg {reaper_totals['ffmpeg']}, "
+                     f"освобождено {reaper_totals['fds']} дескрипторов и {reaper_totals['bytes'] / 1024 ** 2:.1f} МБ")
+    lines.append(f"🎛 Плееров: {sched['players']}, команд в очередях: {sched['pending']} "
+                 f"(макс. {sched['max_depth']}), средняя задержка {fmt_ms(sched['avg_latency'])}")
+    lines.append(f"🗂 Кэш треков: {track_cache.hits} попаданий / {track_cache.misses} промахов")
+    if dead_tracks:
+        lines.append(f"🪦 Неиграбельных треков исключено: {len(dead_tracks)}")
+    open_hosts = source_breaker.open_hosts()
+    if open_hosts:
+        lines.append(f"🚧 Временно отключены источники: {', '.join(open_hosts)}")
+    if audio_cache:
+        lines.append(f"💾 Кэш аудио на диске: {len(audio_cache)} файлов, "
+                     f"{audio_cache.total_bytes / 1024 ** 2:.0f} МБ, {audio_cache.hits} проигрываний с диска")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+
 # ============================================================================
 # КОМАНДЫ - АДМИН
 # ============================================================================
@@ -1025,6 +3856,7 @@ async def set_admin_roles(interaction: discord.Interaction, role_names: str):
         return await interaction.response.send_message("⚠️ Не найдено ни одной роли.", ephemeral=True)
     
     admin_roles[interaction.guild.id] = [role.id for role in roles]
+    _publish("admin_roles", interaction.guild.id)
     await interaction.response.send_message(
         f"✅ Роли для админ-команд установлены: {', '.join(role.mention for role in roles)}"
     )
@@ -1082,6 +3914,7 @@ async def set_support_roles(interaction: discord.Interaction, role_names: str):
         return await interaction.response.send_message("❌ Роли не найдены.", ephemeral=True)
     
     support_roles[interaction.guild.id] = [r.id for r in roles]
+    _publish("support_roles", interaction.guild.id)
     await interaction.response.send_message(
         f"✅ Роли поддержки установлены: {', '.join(r.mention for r in roles)}",
         ephemeral=True
@@ -1116,6 +3949,7 @@ async def setup_voice(
         "trigger_channel_id": trigger_channel.id,
         "temp_category_id": category.id,
     }
+    _publish("server_settings", guild_id)
     
     await interaction.response.send_message(
         f"✅ Настройки сохранены!\n"
@@ -1187,6 +4021,7 @@ async def setup_welcome(interaction: discord.Interaction, channel: discord.TextC
     st.setdefault("message", DEFAULT_WELCOME)
     st.setdefault("use_banner", True)
     st.setdefault("image_url", "")
+    _publish("welcome_settings", interaction.guild.id)
     
     await interaction.response.send_message(
         f"✅ Канал для приветствий установлен: {channel.mention}",
@@ -1203,6 +4038,7 @@ async def set_welcome_message(interaction: discord.Interaction, message: str):
     
     st = welcome_settings.setdefault(interaction.guild.id, {})
     st["message"] = message
+    _publish("welcome_settings", interaction.guild.id)
     
     preview = message.replace("{user}", interaction.user.mention).replace("{server}", interaction.guild.name)
     await interaction.response.send_message(
@@ -1232,6 +4068,7 @@ async def slash_clear(interaction: discord.Interaction, amount: int):
 @is_admin()
 async def setlog(interaction: discord.Interaction, channel: discord.TextChannel):
     log_channels[interaction.guild.id] = channel.id
+    _publish("log_channels", interaction.guild.id)
     await interaction.response.send_message(
         f"✅ Канал для логов установлен на {channel.mention}", ephemeral=True
     )
@@ -1271,6 +4108,7 @@ async def set_role_rank(interaction: discord.Interaction, role: str, rank: int):
     else:
         gmap[r.id] = rank
         msg = f"✅ Для роли {r.mention} установлен ранг **{rank}**."
+    _publish("mod_role_ranks", interaction.guild.id)
     
     await interaction.response.send_message(msg, ephemeral=True)
 
@@ -1285,50 +4123,209 @@ async def warn_cmd(interaction: discord.Interaction, user: discord.Member, reaso
     )
 
 
-async def setup_muted_role(guild: discord.Guild) -> discord.Role:
-    role = discord.utils.get(guild.roles, name="Muted")
+# сервер -> ID роли Muted; сама роль берётся из кэша гильдии без перебора ролей
+muted_role_ids: Dict[int, int] = {}
+_muted_role_locks: Dict[int, asyncio.Lock] = {}
+_muted_sweeps: Dict[int, asyncio.Task] = {}
+
+MUTED_OVERWRITE = discord.PermissionOverwrite(send_messages=False, add_reactions=False, connect=False, speak=False)
+
+
+def get_muted_role(guild: discord.Guild) -> Optional[discord.Role]:
+    role_id = muted_role_ids.get(guild.id)
+    role = guild.get_role(role_id) if role_id else None
     if role is None:
-        role = await guild.create_role(name="Muted", reason="Роль для мута")
-        for ch in guild.channels:
-            try:
-                await ch.set_permissions(role, send_messages=False, add_reactions=False, connect=False, speak=False)
-            except (discord.Forbidden, discord.HTTPException):
-                pass
+        role = discord.utils.get(guild.roles, name="Muted")
+        if role is not None:
+            muted_role_ids[guild.id] = role.id
     return role
 
 
+async def setup_muted_role(guild: discord.Guild, report_channel: Optional[discord.abc.Messageable] = None) -> discord.Role:
+    """Роль Muted сервера; новая роль сразу готова, права каналов настраиваются в фоне"""
+    role = get_muted_role(guild)
+    if role is not None:
+        return role
+    
+    # два одновременных мута не должны создать две роли
+    lock = _muted_role_locks.setdefault(guild.id, asyncio.Lock())
+    async with lock:
+        role = get_muted_role(guild)
+        if role is None:
+            role = await guild.create_role(name="Muted", reason="Роль для мута")
+            muted_role_ids[guild.id] = role.id
+            sweep = _muted_sweeps.get(guild.id)
+            if sweep is None or sweep.done():
+                _muted_sweeps[guild.id] = asyncio.create_task(
+                    apply_muted_overwrites(guild, role, report_channel)
+                )
+    return role
+
+
+async def _apply_muted_overwrite(channel: discord.abc.GuildChannel, role: discord.Role) -> bool:
+    if channel.overwrites_for(role) == MUTED_OVERWRITE:
+        return True
+    try:
+        await channel.set_permissions(role, overwrite=MUTED_OVERWRITE, reason="Роль для мута")
+        return True
+    except (discord.Forbidden, discord.NotFound):
+        return False
+
+
+async def apply_muted_overwrites(guild: discord.Guild, role: discord.Role,
+                                 report_channel: Optional[discord.abc.Messageable] = None) -> Tuple[int, int]:
+    """Запретить роли писать и говорить во всех каналах; вернуть (настроено, всего)"""
+    channels = list(guild.channels)
+    total = len(channels)
+    done = failed = 0
+    # параллельно, но понемногу: на 429 discord.py сам ждёт и повторяет запрос
+    slots = asyncio.Semaphore(MUTED_OVERWRITE_CONCURRENCY)
+    
+    async def apply(channel):
+        nonlocal done, failed
+        async with slots:
+            try:
+                ok = await _apply_muted_overwrite(channel, role)
+            except discord.HTTPException as e:
+                logging.warning(f"Права Muted для #{channel} не выставлены: {e}")
+                ok = False
+        done += 1
+        failed += not ok
+    
+    status = None
+    if report_channel is not None and total:
+        try:
+            status = await report_channel.send(f"🔧 Настраиваю роль Muted: 0/{total} каналов")
+        except discord.HTTPException:
+            status = None
+    
+    tasks = [asyncio.create_task(apply(channel)) for channel in channels]
+    pending = set(tasks)
+    while pending:
+        _, pending = await asyncio.wait(pending, timeout=MUTED_PROGRESS_INTERVAL)
+        if pending:
+            logging.info(f"🔧 Роль Muted на сервере {guild.id}: {done}/{total} каналов")
+            if status is not None:
+                try:
+                    await status.edit(content=f"🔧 Настраиваю роль Muted: {done}/{total} каналов")
+                except discord.HTTPException:
+                    status = None
+    
+    summary = f"✅ Роль Muted настроена: {total - failed}/{total} каналов"
+    if failed:
+        summary += f" (без прав — {failed})"
+    logging.info(f"{summary} — сервер {guild.id}")
+    if status is not None:
+        try:
+            await status.edit(content=summary)
+        except discord.HTTPException:
+            pass
+    return total - failed, total
+
+
+@bot.listen("on_guild_channel_create")
+async def _mute_new_channel(channel: discord.abc.GuildChannel):
+    """Новый канал получает запрет для Muted сразу, без обхода всего сервера"""
+    role = get_muted_role(channel.guild)
+    if role is None:
+        return
+    try:
+        await _apply_muted_overwrite(channel, role)
+    except discord.HTTPException as e:
+        logging.warning(f"Права Muted для нового канала #{channel} не выставлены: {e}")
+
+
+@bot.listen("on_guild_role_delete")
+async def _forget_muted_role(role: discord.Role):
+    if muted_role_ids.get(role.guild.id) == role.id:
+        del muted_role_ids[role.guild.id]
+
+
+def is_muted(member: discord.Member) -> bool:
+    if member.is_timed_out():
+        return True
+    role = get_muted_role(member.guild)
+    return role is not None and member.get_role(role.id) is not None
+
+
+async def apply_mute(member: discord.Member, duration: timedelta, reason: str,
+                     report_channel: Optional[discord.abc.Messageable] = None, notify: bool = False) -> str:
+    """Замьютить выбранным на сервере способом; вернуть использованный ("timeout" / "role")"""
+    guild = member.guild
+    # Discord считает 28 дней от своего времени и отклоняет ровно предел — берём с запасом
+    if mute_backends.get(guild.id, MUTE_BACKEND_DEFAULT) == "timeout" and duration < MUTE_TIMEOUT_MAX - timedelta(minutes=1):
+        try:
+            # один запрос, снимет сам Discord — ни прав каналов, ни таймера бота
+            await member.timeout(duration, reason=reason)
+            return "timeout"
+        except discord.Forbidden:
+            # нет права «Управление участниками» или цель выше бота — пробуем роль
+            pass
+        except discord.HTTPException as e:
+            logging.warning(f"Тайм-аут для {member} не выдан ({e}), мьютим ролью")
+    
+    role = await setup_muted_role(guild, report_channel)
+    await member.add_roles(role, reason=reason)
+    mute_scheduler.schedule(guild.id, member.id, time.time() + duration.total_seconds(), notify=notify)
+    return "role"
+
+
+async def lift_mute(member: discord.Member, reason: str) -> bool:
+    """Снять мут любого вида; False — участник не был замьючен"""
+    lifted = False
+    if member.is_timed_out():
+        await member.timeout(None, reason=reason)
+        lifted = True
+    
+    role = get_muted_role(member.guild)
+    if role is not None and member.get_role(role.id) is not None:
+        await member.remove_roles(role, reason=reason)
+        lifted = True
+    mute_scheduler.cancel(member.guild.id, member.id)
+    return lifted
+
+
+@bot.tree.command(name="set_mute_backend", description="Способ мута: тайм-аут Discord или роль Muted")
+@app_commands.describe(backend="timeout — встроенный тайм-аут (до 28 дней), role — роль Muted")
+@app_commands.choices(backend=[
+    app_commands.Choice(name="Тайм-аут Discord", value="timeout"),
+    app_commands.Choice(name="Роль Muted", value="role"),
+])
+@is_admin()
+async def set_mute_backend(interaction: discord.Interaction, backend: app_commands.Choice[str]):
+    mute_backends[interaction.guild.id] = backend.value
+    _publish("mute_backends", interaction.guild.id)
+    await interaction.response.send_message(f"✅ Способ мута: **{backend.name}**", ephemeral=True)
+
+
 @bot.tree.command(name="mute", description="Замьютить участника на N минут")
 @requires_rank(2)
 @app_commands.describe(member="Кого замьютить", minutes="На сколько минут (по умолчанию 10)", reason="Причина")
-async def mute_cmd(interaction: discord.Interaction, member: discord.Member, minutes: Optional[int] = 10, reason: Optional[str] = None):
-    role = await setup_muted_role(interaction.guild)
+async def mute_cmd(interaction: discord.Interaction, member: discord.Member,
+                   minutes: app_commands.Range[int, 1, MUTE_MINUTES_MAX] = 10, reason: Optional[str] = None):
     try:
-        await member.add_roles(role, reason=reason or f"Mute {minutes}m by {interaction.user}")
-        await interaction.response.send_message(f"🔇 {member.mention} замьючен на {minutes} мин.", ephemeral=True)
+        await apply_mute(
+            member, timedelta(minutes=minutes), reason or f"Mute {minutes}m by {interaction.user}", interaction.channel
+        )
     except discord.Forbidden:
         return await interaction.response.send_message("❌ Нет прав выдать мут.", ephemeral=True)
-    
-    async def unmute_after():
-        await asyncio.sleep(max(1, int(minutes)) * 60)
-        try:
-            await member.remove_roles(role, reason="Mute expired")
-        except Exception:
-            pass
-    asyncio.create_task(unmute_after())
+    except discord.HTTPException as e:
+        logging.error(f"Ошибка мута {member}: {e}")
+        return await interaction.response.send_message("❌ Не удалось выдать мут.", ephemeral=True)
+    await interaction.response.send_message(f"🔇 {member.mention} замьючен на {minutes} мин.", ephemeral=True)
 
 
 @bot.tree.command(name="unmute", description="Снять мут с участника")
 @requires_rank(2)
 @app_commands.describe(member="С кого снять мут", reason="Причина")
 async def unmute_cmd(interaction: discord.Interaction, member: discord.Member, reason: Optional[str] = None):
-    role = discord.utils.get(interaction.guild.roles, name="Muted")
-    if role is None or role not in member.roles:
-        return await interaction.response.send_message("ℹ️ Этот участник не замьючен.", ephemeral=True)
     try:
-        await member.remove_roles(role, reason=reason or f"Unmute by {interaction.user}")
-        await interaction.response.send_message(f"📈 Мут снят с {member.mention}.", ephemeral=True)
+        lifted = await lift_mute(member, reason or f"Unmute by {interaction.user}")
     except discord.Forbidden:
-        await interaction.response.send_message("❌ Нет прав снять мут.", ephemeral=True)
+        return await interaction.response.send_message("❌ Нет прав снять мут.", ephemeral=True)
+    if not lifted:
+        return await interaction.response.send_message("ℹ️ Этот участник не замьючен.", ephemeral=True)
+    await interaction.response.send_message(f"📈 Мут снят с {member.mention}.", ephemeral=True)
 
 
 @bot.tree.command(name="ban", description="Забанить пользователя")
@@ -1429,6 +4426,7 @@ async def lock_chat(interaction: discord.Interaction, channel: Optional[discord.
         "members": snapshot_members,
         "everyone": everyone,
     }
+    _publish("lock_snapshots", interaction.guild.id)
     
     ow_every = ch.overwrites_for(interaction.guild.default_role)
     ow_every.send_messages = False
@@ -1500,36 +4498,302 @@ async def unlock_chat(interaction: discord.Interaction, channel: Optional[discor
             del LOCK_SNAPSHOTS[interaction.guild.id]
     except KeyError:
         pass
+    _publish("lock_snapshots", interaction.guild.id)
     
     await interaction.response.send_message(f"🔓 Канал {ch.mention} открыт, права восстановлены.", ephemeral=True)
 
 
+# ============================================================================
+# ТАЙМЕРЫ МУТОВ
+# ============================================================================
+
+class MuteScheduler:
+    """Снятие мутов по сроку: куча сроков и одна задача на все серверы"""
+    
+    def __init__(self, timers: Dict[int, Dict[int, dict]]):
+        # сами сроки живут в mute_timers и сохраняются вместе с настройками
+        self.timers = timers
+        self._heap: List[Tuple[float, int, int]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+    
+    def __len__(self) -> int:
+        return sum(len(users) for users in self.timers.values())
+    
+    def schedule(self, guild_id: int, user_id: int, until: float, notify: bool = False):
+        self.timers.setdefault(guild_id, {})[user_id] = {"until": until, "notify": notify}
+        _publish("mute_timers", guild_id)
+        heapq.heappush(self._heap, (until, guild_id, user_id))
+        if self._heap[0] == (until, guild_id, user_id):
+            # новый срок раньше всех — задача должна проснуться к нему
+            self._wakeup.set()
+    
+    def cancel(self, guild_id: int, user_id: int) -> bool:
+        """Забыть срок (запись в куче отбросится при извлечении)"""
+        users = self.timers.get(guild_id)
+        if not users or users.pop(user_id, None) is None:
+            return False
+        if not users:
+            del self.timers[guild_id]
+        _publish("mute_timers", guild_id)
+        return True
+    
+    def start(self):
+        """Запустить задачу; просроченные за время простоя муты снимутся сразу"""
+        if self._task and not self._task.done():
+            return
+        self._heap = [
+            (entry["until"], guild_id, user_id)
+            for guild_id, users in self.timers.items()
+            for user_id, entry in users.items()
+        ]
+        heapq.heapify(self._heap)
+        self._task = asyncio.create_task(self._run())
+    
+    def _is_current(self, until: float, guild_id: int, user_id: int) -> bool:
+        entry = self.timers.get(guild_id, {}).get(user_id)
+        return entry is not None and entry["until"] == until
+    
+    async def _run(self):
+        while True:
+            now = time.time()
+            due: Dict[int, List[int]] = {}
+            while self._heap and self._heap[0][0] <= now:
+                until, guild_id, user_id = heapq.heappop(self._heap)
+                # снятый вручную или продлённый мут оставил в куче устаревшую запись
+                if self._is_current(until, guild_id, user_id):
+                    due.setdefault(guild_id, []).append(user_id)
+            
+            for guild_id, user_ids in due.items():
+                try:
+                    await self._expire_guild(guild_id, user_ids)
+                except Exception as e:
+                    logging.error(f"Ошибка снятия мутов на сервере {guild_id}: {e}")
+            
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _expire_guild(self, guild_id: int, user_ids: List[int]):
+        """Снять все истёкшие муты сервера одной пачкой"""
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            # сервер обслуживает другой процесс кластера — сроки остаются ему
+            return
+        
+        users = self.timers.get(guild_id, {})
+        entries = {user_id: users.pop(user_id) for user_id in user_ids}
+        if not users:
+            self.timers.pop(guild_id, None)
+        _publish("mute_timers", guild_id)
+        
+        role = get_muted_role(guild)
+        if role is None:
+            return
+        
+        async def unmute(user_id: int, entry: dict):
+            member = guild.get_member(user_id)
+            if member is None or role not in member.roles:
+                return
+            await member.remove_roles(role, reason="Истёк срок мута")
+            self.expired += 1
+            if entry.get("notify"):
+                try:
+                    await member.send(f"✅ Ваш мут в **{guild.name}** снят. Пожалуйста, не спамьте снова.")
+                except discord.Forbidden:
+                    pass
+        
+        results = await asyncio.gather(
+            *(unmute(user_id, entry) for user_id, entry in entries.items()), return_exceptions=True
+        )
+        for user_id, result in zip(entries, results):
+            if isinstance(result, Exception):
+                logging.error(f"Не удалось снять мут с {user_id} на сервере {guild_id}: {result}")
+
+
+mute_scheduler = MuteScheduler(mute_timers)
+
+
 # ============================================================================
 # АНТИСПАМ
 # ============================================================================
 
-async def mute_user(member: discord.Member, guild: discord.Guild, context_channel: discord.TextChannel):
-    """Мьютит пользователя"""
-    role = await setup_muted_role(guild)
+class SpamTracker:
+    """Частота сообщений по (сервер, пользователь): кольцевые буферы в плоских массивах"""
+    
+    # сколько слотов проверять за один шаг фоновой очистки
+    EVICT_CHUNK = 10_000
+    
+    def __init__(self, threshold: int, window: float):
+        self.threshold = threshold
+        self.window = window
+        # ключ (сервер << 64 | пользователь) -> номер слота
+        self._index: Dict[int, int] = {}
+        self._keys: List[Optional[int]] = []
+        self._free: List[int] = []
+        # слот i: последние threshold отметок времени в _times[i * threshold:(i + 1) * threshold]
+        self._times = array("d")
+        self._pos = array("B")
+        self._last = array("d")
+        self._empty = array("d", [0.0]) * threshold
+        self.evicted = 0
+    
+    def __len__(self) -> int:
+        return len(self._index)
     
-    if role in member.roles:
+    @staticmethod
+    def _key(guild_id: Optional[int], user_id: int) -> int:
+        return ((guild_id or 0) << 64) | user_id
+    
+    def _slot(self, key: int) -> int:
+        slot = self._index.get(key)
+        if slot is not None:
+            return slot
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._times.extend(self._empty)
+            self._pos.append(0)
+            self._last.append(0.0)
+        self._index[key] = slot
+        return slot
+    
+    def hit(self, guild_id: Optional[int], user_id: int, now: float) -> bool:
+        """Учесть сообщение; True — threshold сообщений уложились в окно"""
+        n = self.threshold
+        slot = self._slot(self._key(guild_id, user_id))
+        base = slot * n
+        pos = self._pos[slot]
+        self._times[base + pos] = now
+        pos = (pos + 1) % n
+        self._pos[slot] = pos
+        self._last[slot] = now
+        # на следующей позиции — сообщение, отправленное threshold - 1 сообщений назад
+        oldest = self._times[base + pos]
+        return oldest > 0 and now - oldest < self.window
+    
+    def reset(self, guild_id: Optional[int], user_id: int):
+        """Начать счёт заново (после мута)"""
+        slot = self._index.get(self._key(guild_id, user_id))
+        if slot is not None:
+            base = slot * self.threshold
+            self._times[base:base + self.threshold] = self._empty
+    
+    def _release(self, slot: int):
+        del self._index[self._keys[slot]]
+        self._keys[slot] = None
+        base = slot * self.threshold
+        self._times[base:base + self.threshold] = self._empty
+        self._pos[slot] = 0
+        self._last[slot] = 0.0
+        self._free.append(slot)
+    
+    async def evict_idle(self, now: float) -> int:
+        """Освободить слоты авторов, молчащих дольше окна (частями, не держа цикл событий)"""
+        cutoff = now - self.window
+        evicted = 0
+        for start in range(0, len(self._keys), self.EVICT_CHUNK):
+            for slot in range(start, min(start + self.EVICT_CHUNK, len(self._keys))):
+                if self._keys[slot] is not None and self._last[slot] < cutoff:
+                    self._release(slot)
+                    evicted += 1
+            await asyncio.sleep(0)
+        self.evicted += evicted
+        return evicted
+    
+    async def forget_guild(self, guild_id: int) -> int:
+        """Освободить слоты всех авторов сервера (частями, как evict_idle)"""
+        released = 0
+        for start in range(0, len(self._keys), self.EVICT_CHUNK):
+            for slot in range(start, min(start + self.EVICT_CHUNK, len(self._keys))):
+                key = self._keys[slot]
+                if key is not None and key >> 64 == guild_id:
+                    self._release(slot)
+                    released += 1
+            await asyncio.sleep(0)
+        return released
+
+
+spam_tracker = SpamTracker(SPAM_THRESHOLD, SPAM_TIME_WINDOW)
+_spam_evict_task: Optional[asyncio.Task] = None
+
+
+async def _spam_evict_loop():
+    while True:
+        await asyncio.sleep(SPAM_EVICT_INTERVAL)
+        try:
+            await spam_tracker.evict_idle(time.time())
+        except Exception as e:
+            logging.error(f"Ошибка очистки счётчика спама: {e}")
+
+
+def start_spam_eviction():
+    global _spam_evict_task
+    if _spam_evict_task is None or _spam_evict_task.done():
+        _spam_evict_task = asyncio.create_task(_spam_evict_loop())
+
+
+async def mute_user(member: discord.Member, guild: discord.Guild, context_channel: Optional[discord.TextChannel]):
+    """Мьютит пользователя"""
+    if is_muted(member):
         return
     
-    await member.add_roles(role, reason="Автоматический мут за спам")
+    await apply_mute(member, timedelta(seconds=MUTE_DURATION), "Автоматический мут за спам",
+                     context_channel, notify=True)
     
+    if context_channel is None:
+        return
     try:
         await context_channel.send(f"🔇 {member.mention} был автоматически замьючен на 2 часа за спам.")
     except Exception as e:
         logging.error(f"Ошибка при отправке сообщения в канал: {e}")
-    
-    await asyncio.sleep(MUTE_DURATION)
-    
-    if role in member.roles:
-        await member.remove_roles(role, reason="Истёк срок мута")
+
+
+# очередь действий автомута: (сервер, пользователь, канал); повторы из той же волны спама отбрасываются
+_mute_queues: List[asyncio.Queue] = [asyncio.Queue(MUTE_QUEUE_MAX) for _ in range(MUTE_WORKERS)]
+_pending_mutes: set = set()
+_mute_workers: List[asyncio.Task] = []
+
+
+def enqueue_auto_mute(guild_id: int, user_id: int, channel_id: int) -> bool:
+    """Поставить автомут в очередь; False — уже ждёт или очередь переполнена"""
+    key = (guild_id, user_id)
+    if key in _pending_mutes:
+        return False
+    try:
+        _mute_queues[guild_id % MUTE_WORKERS].put_nowait((guild_id, user_id, channel_id))
+    except asyncio.QueueFull:
+        logging.warning(f"Очередь автомута переполнена, пропущен {user_id} на сервере {guild_id}")
+        return False
+    _pending_mutes.add(key)
+    return True
+
+
+async def _mute_worker(queue: asyncio.Queue):
+    while True:
+        guild_id, user_id, channel_id = await queue.get()
         try:
-            await member.send(f"✅ Ваш мут в **{guild.name}** снят. Пожалуйста, не спамьте снова.")
-        except discord.Forbidden:
-            pass
+            guild = bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild else None
+            if member is not None:
+                await mute_user(member, guild, guild.get_channel(channel_id))
+        except Exception as e:
+            logging.error(f"Ошибка автомута {user_id} на сервере {guild_id}: {e}")
+        finally:
+            _pending_mutes.discard((guild_id, user_id))
+
+
+def start_mute_workers():
+    if any(not task.done() for task in _mute_workers):
+        return
+    _mute_workers[:] = [asyncio.create_task(_mute_worker(queue)) for queue in _mute_queues]
 
 
 @bot.event
@@ -1537,18 +4801,13 @@ async def on_message(message):
     if message.author.bot:
         return
     
-    now = time.time()
-    user_id = message.author.id
-    
-    history = user_message_history.get(user_id, [])
-    history = [timestamp for timestamp in history if now - timestamp < SPAM_TIME_WINDOW]
-    history.append(now)
-    user_message_history[user_id] = history
-    
-    if len(history) >= SPAM_THRESHOLD:
-        if not any(role.name == "Muted" for role in message.author.roles):
-            await mute_user(message.author, message.guild, message.channel)
-            user_message_history[user_id] = []
+    # счёт по (сервер, пользователь): спам на одном сервере не влияет на другие
+    guild_id = message.guild.id if message.guild else None
+    if guild_id and spam_tracker.hit(guild_id, message.author.id, time.time()):
+        if not is_muted(message.author):
+            # сам мут — в фоне: обработчик сообщения не ждёт Discord API
+            enqueue_auto_mute(guild_id, message.author.id, message.channel.id)
+            spam_tracker.reset(guild_id, message.author.id)
     
     await bot.process_commands(message)
 
@@ -1563,10 +4822,18 @@ async def on_ready():
     activity = discord.Game(name="/help ❤")
     await bot.change_presence(status=discord.Status.online, activity=activity)
     
-    bot.add_view(MusicControlView())
+    bot.add_view(get_music_control_view())
     bot.add_view(TicketView())
     bot.add_view(ControlMenuView())
-    
+    start_music_reaper()
+    mute_scheduler.start()
+    start_player_snapshots()
+    start_spam_eviction()
+    start_mute_workers()
+    
+    if CLUSTER_SHARD_IDS and CLUSTER_ID != "0":
+        # команды глобальные — в кластере их синхронизирует только первый процесс
+        return
     try:
         synced = await tree.sync()
         logging.info(f"📄 Синхронизировано {len(synced)} команд")
@@ -1613,6 +4880,57 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
                 pass
 
 
+@bot.listen("on_voice_state_update")
+async def _resume_music_on_reconnect(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    """Бот вернулся в войс — продолжить прерванный трек с той же позиции"""
+    if member.id != bot.user.id or after.channel is None:
+        return
+    player = music_players.get(member.guild.id)
+    if not player or not player.queue:
+        return
+    
+    for _ in range(50):
+        vc = member.guild.voice_client
+        if vc and vc.is_connected():
+            break
+        await asyncio.sleep(0.1)
+    else:
+        return
+    
+    if not vc.is_playing() and not vc.is_paused():
+        player.vc = vc
+        player.submit("play")
+
+
+async def purge_guild_state(guild_id: int):
+    """Забыть всё, что хранится по серверу (бот вышел или сервер удалён)"""
+    for namespace, store in SHARED_STATE.items():
+        if store.pop(guild_id, None) is not None:
+            _publish(namespace, guild_id)
+    for key in [k for k in user_temp_vcs if k[0] == guild_id]:
+        del user_temp_vcs[key]
+    await spam_tracker.forget_guild(guild_id)
+    muted_role_ids.pop(guild_id, None)
+    _muted_role_locks.pop(guild_id, None)
+    sweep = _muted_sweeps.pop(guild_id, None)
+    if sweep is not None and not sweep.done():
+        # каналов сервера больше нет — настраивать права незачем
+        sweep.cancel()
+
+
+@bot.listen("on_guild_remove")
+async def _purge_removed_guild(guild: discord.Guild):
+    await voice_scheduler.shutdown(guild.id)
+    await purge_guild_state(guild.id)
+    logging.info(f"🧹 Сервер {guild.id} (шард {guild.shard_id}) удалён, состояние очищено")
+
+
+@bot.listen("on_shard_ready")
+async def _log_shard_ready(shard_id: int):
+    guilds = sum(1 for g in bot.guilds if g.shard_id == shard_id)
+    logging.info(f"🔷 Шард {shard_id} готов, серверов: {guilds}")
+
+
 @bot.listen("on_member_join")
 async def _welcome_on_join(member: discord.Member):
     st = welcome_settings.get(member.guild.id)
@@ -1732,6 +5050,7 @@ async def _rank_check_error(interaction: discord.Interaction, error):
 @setlog.error
 @set_support_roles.error
 @setup_voice.error
+@set_mute_backend.error
 async def _admin_check_error(interaction: discord.Interaction, error):
     if isinstance(error, app_commands.CheckFailure):
         if interaction.response.is_done():